@@ -1,79 +1,313 @@
 """
 Chat API endpoints
 """
+import asyncio
+import json
 import logging
+import time
+from typing import AsyncIterator, Any, Dict, List, Optional, Tuple
+
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
-from app.models.schemas import ChatRequest, ChatResponse
+from app.core.config import settings
+from app.models.schemas import (
+    ChatRequest, ChatResponse, BatchChatRequest, BatchChatItem, BatchChatSummary
+)
+from app.services.conversation import Session, session_store
 from app.services.rag_service import rag_service
+from app.utils import metrics
 from app.utils.content_filter import content_filter
+from app.utils.timing import current_timings, stage
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+async def _topic_gate(message: str, keyword_match: bool) -> Tuple[bool, Optional[List[float]]]:
+    """Decide whether a message is on topic, returning the query embedding if one was computed"""
+    if settings.TOPIC_GATE_MODE != "embedding":
+        return keyword_match, None
+    verdict = await rag_service.aclassify(message)
+    if verdict is None:
+        # Gate not built yet (or embedding failed): fall back to keywords
+        return keyword_match, None
+    return verdict["gym_related"], verdict["vector"]
+
+async def _resolve(message: str, keyword_match: bool,
+                   session_id: Optional[str]) -> Tuple[Optional[Session], str, bool, Optional[List[float]]]:
+    """Load the session, condense a follow-up into a standalone query and gate it"""
+    # The session store may read SQLite, so it runs off the event loop
+    session = await asyncio.to_thread(session_store.get, session_id) if session_id else None
+    query = await rag_service.acondense(message, session)
+    if query != message:
+        keyword_match = keyword_match or content_filter.is_gym_related(query)
+    gym_related, query_vector = await _topic_gate(query, keyword_match)
+    return session, query, gym_related, query_vector
+
+def _fallback(message: str, reason: str, gym_related: bool = True) -> str:
+    """Canned answer, counted in /metrics by reason"""
+    metrics.fallbacks.inc(reason=reason)
+    return content_filter.get_fallback_response(message, gym_related=gym_related)
+
+def _stage_breakdown(start: float) -> Optional[Dict[str, float]]:
+    """Milliseconds per stage of the current request, plus total_ms"""
+    timings = current_timings()
+    if timings is None:
+        return None
+    breakdown = {f"{name}_ms": round(ms, 2) for name, ms in timings.stages.items()}
+    breakdown["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return breakdown
+
 @router.post("/", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """Main chat endpoint for gym-related questions"""
+    start = time.perf_counter()
+    response = await _chat(request)
+    response.timings = _stage_breakdown(start)
+    return response
+
+async def _chat(request: ChatRequest) -> ChatResponse:
+    """Answer one chat request"""
     try:
         # Validate and filter content
-        validation = content_filter.validate_message(request.message)
+        with stage("filter"):
+            validation = content_filter.validate_message(request.message)
         
         if not validation["valid"]:
             raise HTTPException(status_code=400, detail=validation["error"])
         
         message = validation["message"]
-        gym_related = validation["gym_related"]
+        session, query, gym_related, query_vector = await _resolve(
+            message, validation["gym_related"], request.session_id
+        )
         
         # If not gym-related, return polite rejection
         if not gym_related:
             return ChatResponse(
-                response=content_filter.get_fallback_response(message),
+                response=_fallback(message, "off_topic", gym_related=False),
                 is_gym_related=False,
-                sources=[]
+                sources=[],
+                session_id=request.session_id
             )
         
-        # Use RAG system if available
-        if rag_service.is_rag_ready():
-            try:
-                result = rag_service.query(message)
-                
-                if result["success"]:
-                    return ChatResponse(
-                        response=result["response"],
-                        is_gym_related=True,
-                        sources=result["sources"]
-                    )
-                else:
-                    # RAG failed, use fallback
-                    logger.warning(f"RAG query failed: {result.get('error', 'Unknown error')}")
-                    fallback_response = content_filter.get_fallback_response(message)
-                    return ChatResponse(
-                        response=fallback_response,
-                        is_gym_related=True,
-                        sources=[]
-                    )
-                    
-            except Exception as e:
-                logger.error(f"RAG query error: {e}")
-                # Fall back to basic response
-                fallback_response = content_filter.get_fallback_response(message)
+        response = await _rag_answer(query, query_vector, session.history() if session else "")
+        if session is not None:
+            await asyncio.to_thread(session_store.record, session, message, response.response, query)
+            response.session_id = session.id
+            response.condensed_query = query if query != message else None
+        return response
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Chat endpoint error: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+async def _rag_answer(message: str, query_vector: Optional[List[float]], history: str) -> ChatResponse:
+    """Answer an on-topic message with RAG, or a canned fallback if RAG is unavailable or fails"""
+    # Use RAG system if available
+    if rag_service.is_rag_ready():
+        try:
+            result = await rag_service.aquery(message, query_vector=query_vector, history=history)
+            
+            if result["success"]:
+                return ChatResponse(
+                    response=result["response"],
+                    is_gym_related=True,
+                    sources=result["sources"],
+                    source_details=result.get("source_details", []),
+                    scores=result.get("scores", []),
+                    answer_mode=result.get("answer_mode")
+                )
+            else:
+                # RAG failed, use fallback
+                logger.warning(f"RAG query failed: {result.get('error', 'Unknown error')}")
+                fallback_response = _fallback(message, "rag_error")
                 return ChatResponse(
                     response=fallback_response,
                     is_gym_related=True,
                     sources=[]
                 )
-        else:
-            # RAG system not available, use fallback
-            fallback_response = content_filter.get_fallback_response(message)
+                
+        except Exception as e:
+            logger.error(f"RAG query error: {e}")
+            # Fall back to basic response
+            fallback_response = _fallback(message, "rag_error")
             return ChatResponse(
                 response=fallback_response,
                 is_gym_related=True,
                 sources=[]
             )
-            
-    except HTTPException:
-        raise
+    else:
+        # RAG system not available, use fallback
+        fallback_response = _fallback(message, "rag_unavailable")
+        return ChatResponse(
+            response=fallback_response,
+            is_gym_related=True,
+            sources=[]
+        )
+
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _fallback_events(message: str, gym_related: bool, start: float) -> AsyncIterator[str]:
+    """Emit a canned answer using the same event sequence as a streamed one"""
+    yield _sse("sources", {"sources": [], "source_details": [], "scores": []})
+    reason = "rag_unavailable" if gym_related else "off_topic"
+    yield _sse("token", {"text": _fallback(message, reason, gym_related=gym_related)})
+    yield _sse("done", {
+        "is_gym_related": gym_related,
+        "timings": {"total_ms": round((time.perf_counter() - start) * 1000, 1)}
+    })
+
+async def _stream_events(message: str, gym_related: bool, query_vector: Optional[List[float]] = None,
+                         session: Optional[Session] = None, query: Optional[str] = None) -> AsyncIterator[str]:
+    """Stream RAG events, falling back to the canned answer if nothing was generated"""
+    start = time.perf_counter()
+    query = query or message
+    
+    if not gym_related or not rag_service.is_rag_ready():
+        async for event in _fallback_events(message, gym_related, start):
+            yield event
+        return
+    
+    sent_tokens = False
+    parts = []
+    history = session.history() if session else ""
+    async for event in rag_service.astream_query(query, query_vector=query_vector, history=history):
+        if event["event"] == "error":
+            logger.warning(f"RAG stream failed: {event['data'].get('error', 'Unknown error')}")
+            if not sent_tokens:
+                yield _sse("token", {"text": _fallback(message, "rag_error")})
+            yield _sse("done", {
+                "is_gym_related": True,
+                "timings": {"total_ms": round((time.perf_counter() - start) * 1000, 1)},
+                "error": event["data"].get("error")
+            })
+            return
+        
+        data = event["data"]
+        if event["event"] == "token":
+            sent_tokens = True
+            parts.append(data["text"])
+        elif event["event"] == "done":
+            # Coalesced requests share the event, so per-request fields go on a copy
+            data = dict(data, is_gym_related=True)
+            if session is not None:
+                await asyncio.to_thread(session_store.record, session, message, "".join(parts), query)
+                data["session_id"] = session.id
+                data["condensed_query"] = query if query != message else None
+        yield _sse(event["event"], data)
+
+@router.post("/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """Stream the answer as server-sent events (sources, token..., done)"""
+    with stage("filter"):
+        validation = content_filter.validate_message(request.message)
+    
+    if not validation["valid"]:
+        raise HTTPException(status_code=400, detail=validation["error"])
+    
+    message = validation["message"]
+    session, query, gym_related, query_vector = await _resolve(
+        message, validation["gym_related"], request.session_id
+    )
+    
+    return StreamingResponse(
+        _stream_events(message, gym_related, query_vector, session, query),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _batch_item(index: int, message: str, entry: Optional[Dict[str, Any]]) -> BatchChatItem:
+    """Turn a batch result (None for off-topic) into an NDJSON item"""
+    result = entry["result"] if entry else None
+    timings = entry["timings"] if entry else {}
+    if result is None:
+        return BatchChatItem(
+            index=index,
+            response=_fallback(message, "off_topic", gym_related=False),
+            is_gym_related=False,
+            timings=timings
+        )
+    if not result["success"]:
+        return BatchChatItem(
+            index=index,
+            response=_fallback(message, "rag_error"),
+            is_gym_related=True,
+            success=False,
+            error=result.get("error", "Unknown error"),
+            timings=timings
+        )
+    return BatchChatItem(
+        index=index,
+        response=result["response"],
+        is_gym_related=True,
+        sources=result["sources"],
+        source_details=result.get("source_details", []),
+        scores=result.get("scores", []),
+        answer_mode=result.get("answer_mode"),
+        cached=entry.get("cached", False),
+        timings=timings
+    )
+
+async def _batch_lines(validations: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Answer a validated batch, yielding one NDJSON line per item as it finishes"""
+    start = time.perf_counter()
+    done = set()
+    succeeded = 0
+    
+    def line(item: BatchChatItem) -> str:
+        nonlocal succeeded
+        done.add(item.index)
+        succeeded += item.success
+        return item.model_dump_json() + "\n"
+    
+    valid = []
+    for index, validation in enumerate(validations):
+        if validation["valid"]:
+            valid.append(index)
+        else:
+            yield line(BatchChatItem(index=index, response="", is_gym_related=False,
+                                     success=False, error=validation["error"]))
+    
+    messages = [validations[i]["message"] for i in valid]
+    try:
+        if not rag_service.is_rag_ready():
+            raise RuntimeError("RAG system not initialized")
+        async for entry in rag_service.abatch_query(messages, [validations[i]["gym_related"] for i in valid]):
+            yield line(_batch_item(valid[entry["index"]], messages[entry["index"]], entry))
     except Exception as e:
-        logger.error(f"Chat endpoint error: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+        logger.error(f"Batch chat error: {e}")
+        for position, index in enumerate(valid):
+            if index not in done:
+                keyword_related = validations[index]["gym_related"]
+                entry = None if not keyword_related else {"result": {"success": False, "error": str(e)}, "timings": {}}
+                yield line(_batch_item(index, messages[position], entry))
+    
+    yield BatchChatSummary(
+        count=len(validations),
+        succeeded=succeeded,
+        total_ms=round((time.perf_counter() - start) * 1000, 1)
+    ).model_dump_json() + "\n"
+
+@router.post("/batch")
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """Answer a list of questions, streaming one NDJSON line per item as each finishes"""
+    if len(request.messages) > settings.MAX_BATCH_MESSAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many messages (max {settings.MAX_BATCH_MESSAGES} per batch)"
+        )
+    
+    with stage("filter"):
+        validations = content_filter.validate_messages(request.messages)
+    return StreamingResponse(
+        _batch_lines(validations),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -3,10 +3,16 @@ Health check and system status API endpoints
 """
 import logging
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 
-from app.models.schemas import HealthResponse, SystemStatus, ResetResponse
+from app.models.schemas import (
+    HealthResponse, SystemStatus, ResetResponse, StatsResponse, JobStatusResponse, ProbeResponse
+)
+from app.services.conversation import session_store
 from app.services.rag_service import rag_service
+from app.services.jobs import job_manager
 from app.core.config import settings
+from app.utils import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -34,20 +40,20 @@ async def health_check():
 
 @router.get("/health", response_model=HealthResponse)
 async def detailed_health():
-    """Detailed health check with system status"""
+    """Detailed health check with system status (reads the cached snapshot; never initializes)"""
     try:
-        system_status = rag_service.get_system_status()
+        snapshot = rag_service.get_health_snapshot()
+        system_status = snapshot["components"]
         all_systems_ready = all(system_status.values())
         
-        # Try to reinitialize if not ready
-        if not rag_service.is_rag_ready():
-            logger.info("Attempting to reinitialize RAG system...")
-            rag_service.initialize_rag_system()
+        message = f"System Status: {system_status} ({snapshot['state']})"
+        if snapshot["last_error"]:
+            message += f"; last build error: {snapshot['last_error']}"
         
         return HealthResponse(
             status="healthy" if all_systems_ready else "degraded",
-            message=f"System Status: {system_status}",
-            rag_enabled=rag_service.is_rag_ready()
+            message=message,
+            rag_enabled=snapshot["ready"]
         )
         
     except Exception as e:
@@ -58,23 +64,59 @@ async def detailed_health():
             rag_enabled=False
         )
 
+def _probe(status: str) -> ProbeResponse:
+    snapshot = rag_service.get_health_snapshot()
+    return ProbeResponse(
+        status=status,
+        **{field: snapshot[field] for field in (
+            "state", "generation", "building", "build_attempts", "last_error", "next_retry_at"
+        )}
+    )
+
+@router.get("/live", response_model=ProbeResponse)
+async def liveness():
+    """Liveness probe: the process is up and its event loop is responding"""
+    return _probe("alive")
+
+@router.get("/ready", response_model=ProbeResponse, responses={503: {"model": ProbeResponse}})
+async def readiness():
+    """Readiness probe: 200 once a RAG generation is serving, 503 while starting or degraded"""
+    probe = _probe("ready" if rag_service.is_rag_ready() else "not_ready")
+    if probe.status != "ready":
+        return JSONResponse(status_code=503, content=probe.model_dump())
+    return probe
+
 @router.post("/reset", response_model=ResetResponse)
 async def reset_system():
-    """Reset and reinitialize the RAG system"""
+    """Rebuild the RAG system in the background; the current one keeps serving until the swap"""
     try:
-        success = rag_service.reset_system()
-        
-        if success:
-            return ResetResponse(
-                status="success",
-                message="RAG system reset and reinitialized successfully"
-            )
-        else:
-            return ResetResponse(
-                status="error",
-                message="Failed to reinitialize RAG system"
-            )
+        job = rag_service.start_reset()
+        return ResetResponse(
+            status="accepted",
+            message="RAG system rebuild started; poll /jobs/{job_id} for progress",
+            job_id=job.id
+        )
             
     except Exception as e:
         logger.error(f"Reset error: {e}")
         raise HTTPException(status_code=500, detail=f"Reset failed: {str(e)}")
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def job_status(job_id: str):
+    """Progress of a background job such as a reset"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return JobStatusResponse(**job.to_dict())
+
+@router.get("/stats", response_model=StatsResponse)
+async def cache_stats():
+    """Cache hit/miss, index build and conversation session statistics"""
+    return StatsResponse(**rag_service.get_cache_stats(), sessions=session_store.get_stats())
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latency histograms, cache, fallback and index metrics in Prometheus text format"""
+    rag_service.update_metrics()
+    session_store.update_metrics()
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -26,18 +26,127 @@ class Settings:
     EMBEDDING_MODEL: str = "models/embedding-001"
     TEMPERATURE: float = 0.3
     
+    # Model Providers ("google" or "local"; local backends need no network or API key)
+    LLM_PROVIDER: str = os.getenv("LLM_PROVIDER", "google").lower()
+    EMBEDDING_PROVIDER: str = os.getenv("EMBEDDING_PROVIDER", "google").lower()
+    LOCAL_EMBEDDING_DIM: int = int(os.getenv("LOCAL_EMBEDDING_DIM", "768"))
+    LOCAL_EMBEDDING_LATENCY_MS: float = float(os.getenv("LOCAL_EMBEDDING_LATENCY_MS", "0"))
+    LOCAL_LLM_FIRST_TOKEN_MS: float = float(os.getenv("LOCAL_LLM_FIRST_TOKEN_MS", "0"))
+    LOCAL_LLM_TOKENS_PER_SECOND: float = float(os.getenv("LOCAL_LLM_TOKENS_PER_SECOND", "0"))  # 0 = no delay
+    LOCAL_LLM_MAX_TOKENS: int = int(os.getenv("LOCAL_LLM_MAX_TOKENS", "120"))
+    
     # RAG Settings
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
-    SIMILARITY_SEARCH_K: int = 3
+    SIMILARITY_SEARCH_K: int = int(os.getenv("SIMILARITY_SEARCH_K", "8"))  # candidates offered to the context packer
+    
+    # Re-ranking Settings ("off", "mmr", "cross-encoder" or "both")
+    RERANK_MODE: str = os.getenv("RERANK_MODE", "off").lower()
+    RERANK_CANDIDATES: int = int(os.getenv("RERANK_CANDIDATES", "20"))
+    RERANK_MMR_LAMBDA: float = float(os.getenv("RERANK_MMR_LAMBDA", "0.7"))  # 1 = pure relevance
+    RERANK_CROSS_ENCODER_MODEL: str = os.getenv("RERANK_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_BUDGET_MS: float = float(os.getenv("RERANK_BUDGET_MS", "50"))
+    
+    # Context Packing Settings (estimated tokens of retrieved context per prompt)
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+    CONTEXT_BRIEF_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_BRIEF_TOKEN_BUDGET", "300"))
+    CONTEXT_MIN_PASSAGE_TOKENS: int = int(os.getenv("CONTEXT_MIN_PASSAGE_TOKENS", "50"))
+    
+    # Hybrid Retrieval Settings (BM25 + FAISS, fused with reciprocal rank fusion)
+    HYBRID_RETRIEVAL: bool = os.getenv("HYBRID_RETRIEVAL", "True").lower() == "true"
+    HYBRID_CANDIDATES: int = int(os.getenv("HYBRID_CANDIDATES", "20"))
+    HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", "60"))
+    BM25_K1: float = 1.5
+    BM25_B: float = 0.75
+    
+    # Retrieval Score Policy (cosine relevance of the best retrieved chunk)
+    RETRIEVAL_MIN_SCORE: float = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.35"))
+    RETRIEVAL_BRIEF_SCORE: float = float(os.getenv("RETRIEVAL_BRIEF_SCORE", "0.5"))
+    BRIEF_MODEL: str = os.getenv("BRIEF_MODEL", GOOGLE_MODEL)
+    BRIEF_MAX_OUTPUT_TOKENS: int = int(os.getenv("BRIEF_MAX_OUTPUT_TOKENS", "256"))
+    
+    # Prompt Prefix Cache (Gemini cached content for the static preamble)
+    PROMPT_CACHE_ENABLED: bool = os.getenv("PROMPT_CACHE_ENABLED", "False").lower() == "true"
+    PROMPT_CACHE_TTL_SECONDS: float = float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+    PROMPT_CACHE_MIN_TOKENS: int = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))  # model's minimum cache size
+    
+    # Answer Cache Settings
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "True").lower() == "true"
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    ANSWER_CACHE_TTL_SECONDS: float = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+    
+    # Topic Gate Settings ("keywords" or "embedding")
+    TOPIC_GATE_MODE: str = os.getenv("TOPIC_GATE_MODE", "keywords").lower()
+    TOPIC_GATE_THRESHOLD: float = float(os.getenv("TOPIC_GATE_THRESHOLD", "0.5"))
+    TOPIC_GATE_CENTROIDS: int = int(os.getenv("TOPIC_GATE_CENTROIDS", "32"))
+    
+    # Conversation Memory Settings (sessions keyed by ChatRequest.session_id)
+    SESSION_MAX_SESSIONS: int = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+    SESSION_TTL_SECONDS: float = float(os.getenv("SESSION_TTL_SECONDS", "86400"))
+    SESSION_MAX_TURNS: int = int(os.getenv("SESSION_MAX_TURNS", "6"))
+    SESSION_TOKEN_BUDGET: int = int(os.getenv("SESSION_TOKEN_BUDGET", "600"))
+    SESSION_TURN_MAX_TOKENS: int = int(os.getenv("SESSION_TURN_MAX_TOKENS", "150"))
+    SESSION_SUMMARY_TOKENS: int = int(os.getenv("SESSION_SUMMARY_TOKENS", "100"))
+    SESSION_DB_PATH: str = os.getenv("SESSION_DB_PATH", "")  # empty = in-memory only
+    QUERY_CONDENSE_MODE: str = os.getenv("QUERY_CONDENSE_MODE", "heuristic").lower()  # "heuristic", "llm" or "off"
+    QUERY_CONDENSE_TIMEOUT_SECONDS: float = float(os.getenv("QUERY_CONDENSE_TIMEOUT_SECONDS", "3"))
+    
+    # Query Concurrency Settings
+    COALESCE_REQUESTS: bool = os.getenv("COALESCE_REQUESTS", "True").lower() == "true"
+    MAX_CONCURRENT_QUERIES: int = int(os.getenv("MAX_CONCURRENT_QUERIES", "16"))
+    QUERY_TIMEOUT_SECONDS: float = float(os.getenv("QUERY_TIMEOUT_SECONDS", "30"))
+    
+    # Initialization Supervisor (retries a failed startup build in the background)
+    SUPERVISOR_BACKOFF_SECONDS: float = float(os.getenv("SUPERVISOR_BACKOFF_SECONDS", "5"))
+    SUPERVISOR_MAX_BACKOFF_SECONDS: float = float(os.getenv("SUPERVISOR_MAX_BACKOFF_SECONDS", "300"))
+    
+    # Production Server Settings (gunicorn.conf.py)
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "0"))  # 0 = one worker per CPU
+    PRELOAD_INDEX: bool = os.getenv("PRELOAD_INDEX", "True").lower() == "true"
+    FAISS_THREADS_PER_WORKER: int = int(os.getenv("FAISS_THREADS_PER_WORKER", "1"))
+    WORKER_MAX_REQUESTS: int = int(os.getenv("WORKER_MAX_REQUESTS", "0"))  # 0 = never recycle
+    GRACEFUL_TIMEOUT_SECONDS: int = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+    
+    # Batch Chat Settings
+    MAX_BATCH_MESSAGES: int = int(os.getenv("MAX_BATCH_MESSAGES", "500"))
+    BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
     
     # File Paths
     PROJECT_ROOT: Path = Path(__file__).parent.parent.parent
     DATA_DIR: Path = PROJECT_ROOT / "data"
-    GYM_DATA_FILE: Path = DATA_DIR / "gym_data.txt"
+    
+    # Corpus Loading Settings
+    CORPUS_FILE_TYPES = {".txt", ".md", ".markdown", ".jsonl"}
+    LOADER_BATCH_SIZE: int = int(os.getenv("LOADER_BATCH_SIZE", "512"))
+    
+    # Embedding Build Pipeline Settings
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+    EMBEDDING_CONCURRENCY: int = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+    EMBEDDING_MAX_RETRIES: int = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+    EMBEDDING_RETRY_BACKOFF_SECONDS: float = float(os.getenv("EMBEDDING_RETRY_BACKOFF_SECONDS", "1.0"))
     
     # FAISS Settings
-    VECTOR_STORE_PATH: Path = DATA_DIR / "vector_store"
+    VECTOR_STORE_PATH: Path = Path(os.getenv("VECTOR_STORE_PATH", str(DATA_DIR / "vector_store")))
+    VECTOR_STORE_MMAP: bool = os.getenv("VECTOR_STORE_MMAP", "True").lower() == "true"
+    
+    # Serving index type: "flat" (exact), "hnsw" or "ivfpq", derived from the flat index
+    FAISS_INDEX_TYPE: str = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+    FAISS_ANN_MIN_VECTORS: int = int(os.getenv("FAISS_ANN_MIN_VECTORS", "10000"))
+    FAISS_TRAIN_SAMPLE: int = int(os.getenv("FAISS_TRAIN_SAMPLE", "50000"))
+    FAISS_HNSW_M: int = int(os.getenv("FAISS_HNSW_M", "32"))
+    FAISS_HNSW_EF_CONSTRUCTION: int = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+    FAISS_HNSW_EF_SEARCH: int = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+    FAISS_IVF_NLIST: int = int(os.getenv("FAISS_IVF_NLIST", "0"))  # 0 = about 4*sqrt(n)
+    FAISS_IVF_NPROBE: int = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+    FAISS_PQ_M: int = int(os.getenv("FAISS_PQ_M", "0"))  # 0 = one byte per 8 dimensions
+    FAISS_PQ_NBITS: int = int(os.getenv("FAISS_PQ_NBITS", "8"))
+    FAISS_BENCHMARK_QUERIES: int = int(os.getenv("FAISS_BENCHMARK_QUERIES", "200"))
+    
+    # Embedding Cache Settings
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "True").lower() == "true"
+    EMBEDDING_CACHE_PATH: Path = VECTOR_STORE_PATH / "embedding_cache"
+    EMBEDDING_CACHE_MAX_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
     
     # Content Filtering
     GYM_KEYWORDS = {
@@ -52,11 +161,22 @@ class Settings:
         "cool down", "hydration", "equipment", "machines", "free weights"
     }
 
+    @property
+    def embedding_model_name(self) -> str:
+        """Identifies the embedding space, so indexes and caches never mix providers"""
+        if self.EMBEDDING_PROVIDER == "local":
+            return f"local-hash-{self.LOCAL_EMBEDDING_DIM}"
+        return self.EMBEDDING_MODEL
+    
+    def uses_google(self) -> bool:
+        """Whether any configured provider calls the Gemini API"""
+        return "google" in (self.LLM_PROVIDER, self.EMBEDDING_PROVIDER)
+    
     def validate_settings(self) -> bool:
         """Validate that required settings are properly configured"""
-        if not self.GOOGLE_API_KEY or self.GOOGLE_API_KEY == "your_google_api_key_here":
+        if self.uses_google() and (not self.GOOGLE_API_KEY or self.GOOGLE_API_KEY == "your_google_api_key_here"):
             return False
-        if not self.GYM_DATA_FILE.exists():
+        if not self.DATA_DIR.exists():
             return False
         return True
 
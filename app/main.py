@@ -8,8 +8,12 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
+from app.services.conversation import session_store
 from app.services.rag_service import rag_service
+from app.services.supervisor import rag_supervisor
 from app.api import chat, health
+from app.utils.process import memory_usage
+from app.utils.timing import ServerTimingMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -23,16 +27,16 @@ async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
     logger.info("Starting GymPro RAG Chatbot...")
-    success = rag_service.initialize_rag_system()
-    if success:
-        logger.info("✅ RAG system initialized successfully")
-    else:
-        logger.warning("⚠️ RAG system initialization failed - using fallback mode")
+    # Build in the background: the API serves fallback answers until /ready passes
+    rag_supervisor.start()
     
     yield
     
     # Shutdown
-    logger.info("Shutting down GymPro RAG Chatbot...")
+    logger.info(f"Shutting down GymPro RAG Chatbot (memory {memory_usage()} MB)...")
+    rag_supervisor.stop()
+    rag_service.flush_caches()
+    session_store.close()
 
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application"""
@@ -54,6 +58,9 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
     
+    # Report per-stage timings (filter, embed, search, llm) in Server-Timing
+    app.add_middleware(ServerTimingMiddleware)
+    
     # Include API routers
     app.include_router(health.router)
     app.include_router(chat.router)
@@ -1,18 +1,53 @@
 """
 Pydantic models for API request/response schemas
 """
-from typing import List
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 
 class ChatRequest(BaseModel):
     """Request model for chat endpoint"""
     message: str = Field(..., min_length=1, max_length=1000, description="User's message to the chatbot")
+    session_id: Optional[str] = Field(None, min_length=1, max_length=64, pattern=r"^[A-Za-z0-9_-]+$",
+                                      description="Conversation id; follow-ups in the same session use its history")
+
+class SourceDetail(BaseModel):
+    """Where a retrieved chunk came from in the corpus"""
+    source: Optional[str] = Field(None, description="Corpus file, relative to the data directory")
+    section: Optional[str] = Field(None, description="Section heading the chunk belongs to")
+    offset: Optional[int] = Field(None, description="Character offset of the chunk in the file")
+    preview: str = Field("", description="Start of the chunk text")
+    score: Optional[float] = Field(None, description="Cosine relevance of the chunk to the question")
 
 class ChatResponse(BaseModel):
     """Response model for chat endpoint"""
     response: str = Field(..., description="Chatbot's response")
     is_gym_related: bool = Field(..., description="Whether the query was gym/fitness related")
     sources: List[str] = Field(default=[], description="Source documents used for the response")
+    source_details: List[SourceDetail] = Field(default=[], description="File, section and offset of each source")
+    scores: List[float] = Field(default=[], description="Relevance score of each source")
+    answer_mode: Optional[str] = Field(None, description="full, brief or no_context, per the retrieval score policy")
+    timings: Optional[Dict[str, float]] = Field(None, description="Milliseconds per stage (filter_ms, embed_ms, search_ms, prompt_ms, llm_ms) and total_ms")
+    session_id: Optional[str] = Field(None, description="Conversation id the turn was recorded under")
+    condensed_query: Optional[str] = Field(None, description="Standalone query used for retrieval when the message was a follow-up")
+
+class BatchChatRequest(BaseModel):
+    """Request model for batch chat endpoint"""
+    messages: List[str] = Field(..., min_length=1, description="Questions to answer, up to MAX_BATCH_MESSAGES")
+
+class BatchChatItem(ChatResponse):
+    """One NDJSON line of the batch chat response"""
+    index: int = Field(..., description="Position of the message in the request")
+    success: bool = Field(True, description="Whether an answer was produced")
+    error: Optional[str] = Field(None, description="Why the item failed")
+    cached: bool = Field(False, description="Whether the answer came from the answer cache")
+    timings: Dict[str, float] = Field(default={}, description="embed_ms, search_ms, llm_ms and total_ms")
+
+class BatchChatSummary(BaseModel):
+    """Final NDJSON line of the batch chat response"""
+    done: bool = Field(True, description="Marks the end of the batch")
+    count: int = Field(..., description="Number of items answered")
+    succeeded: int = Field(..., description="Items answered without error")
+    total_ms: float = Field(..., description="Wall time for the whole batch")
 
 class HealthResponse(BaseModel):
     """Response model for health check endpoints"""
@@ -27,7 +62,37 @@ class SystemStatus(BaseModel):
     embeddings_ready: bool
     google_api_configured: bool
 
+class ProbeResponse(BaseModel):
+    """Response model for liveness and readiness probes"""
+    status: str = Field(..., description="alive, ready or not_ready")
+    state: str = Field(..., description="RAG state: starting, building, ready or degraded")
+    generation: Optional[str] = Field(None, description="Id of the serving RAG generation")
+    building: bool = Field(False, description="Whether a build is in progress")
+    build_attempts: int = Field(0, description="Builds attempted since startup")
+    last_error: Optional[str] = Field(None, description="Why the last build failed")
+    next_retry_at: Optional[float] = Field(None, description="Unix time of the next supervisor retry")
+
 class ResetResponse(BaseModel):
     """Response model for system reset endpoint"""
     status: str = Field(..., description="Reset operation status")
     message: str = Field(..., description="Reset operation message")
+    job_id: Optional[str] = Field(None, description="Background rebuild job to poll at /jobs/{job_id}")
+
+class JobStatusResponse(BaseModel):
+    """Response model for background job status"""
+    job_id: str = Field(..., description="Job identifier")
+    kind: str = Field(..., description="Job type, e.g. reset")
+    status: str = Field(..., description="pending, running, succeeded or failed")
+    message: str = Field("", description="Outcome message")
+    progress: Dict[str, Any] = Field(default={}, description="Current stage and stage details")
+    created_at: float = Field(..., description="Unix time the job was submitted")
+    started_at: Optional[float] = Field(None, description="Unix time the job started")
+    finished_at: Optional[float] = Field(None, description="Unix time the job finished")
+
+class StatsResponse(BaseModel):
+    """Response model for cache and index build statistics endpoint"""
+    embedding_cache: Optional[Dict[str, Any]] = Field(None, description="Embedding cache hit/miss counters")
+    answer_cache: Optional[Dict[str, Any]] = Field(None, description="Answer cache hit ratio and occupancy")
+    index_build: Optional[Dict[str, Any]] = Field(None, description="Throughput (chunks/sec) and retries of the last index update")
+    sessions: Optional[Dict[str, Any]] = Field(None, description="Conversation sessions held and the memory they use")
+    coalescing: Optional[Dict[str, int]] = Field(None, description="Requests that ran versus joined an identical one in flight")
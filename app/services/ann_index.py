@@ -0,0 +1,145 @@
+"""
+Approximate-nearest-neighbour FAISS indexes derived from the flat index
+"""
+import logging
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+FLAT = "flat"
+HNSW = "hnsw"
+IVFPQ = "ivfpq"
+
+# Vectors added to an index per call when copying from the flat index
+ADD_BATCH = 65536
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest divisor of the dimension that gives about 1 byte per 8 dimensions"""
+    target = max(1, dim // 8)
+    return max(m for m in range(1, target + 1) if dim % m == 0)
+
+
+def describe(ntotal: int, dim: int) -> Optional[str]:
+    """FAISS index_factory string for the configured index type, or None to serve the flat index"""
+    index_type = settings.FAISS_INDEX_TYPE
+    if index_type == FLAT:
+        return None
+    if ntotal < settings.FAISS_ANN_MIN_VECTORS:
+        logger.info(f"{ntotal} vectors is below FAISS_ANN_MIN_VECTORS; serving the flat index")
+        return None
+
+    if index_type == HNSW:
+        return f"HNSW{settings.FAISS_HNSW_M},Flat"
+    if index_type == IVFPQ:
+        if ntotal < 2 ** settings.FAISS_PQ_NBITS:
+            logger.info(f"{ntotal} vectors is too few to train PQ codebooks; serving the flat index")
+            return None
+        # Aim for ~4*sqrt(n) lists but keep at least 39 training points per list
+        nlist = settings.FAISS_IVF_NLIST or int(4 * math.sqrt(ntotal))
+        nlist = max(1, min(nlist, ntotal // 39))
+        pq_m = settings.FAISS_PQ_M or _pq_subquantizers(dim)
+        return f"IVF{nlist},PQ{pq_m}x{settings.FAISS_PQ_NBITS}"
+
+    logger.warning(f"Unknown FAISS_INDEX_TYPE {index_type!r}; serving the flat index")
+    return None
+
+
+def build(flat: faiss.Index, description: str) -> faiss.Index:
+    """Train an index of the given type on a sample of the flat vectors, then add them all in order
+
+    Positions match the flat index, so the existing docstore mapping still applies.
+    """
+    ntotal = flat.ntotal
+    index = faiss.index_factory(flat.d, description, faiss.METRIC_L2)
+    if settings.FAISS_INDEX_TYPE == HNSW:
+        faiss.downcast_index(index).hnsw.efConstruction = settings.FAISS_HNSW_EF_CONSTRUCTION
+
+    if not index.is_trained:
+        rng = np.random.default_rng(1234)
+        sample_size = min(ntotal, settings.FAISS_TRAIN_SAMPLE)
+        sample_ids = np.sort(rng.choice(ntotal, size=sample_size, replace=False))
+        start = time.perf_counter()
+        index.train(flat.reconstruct_batch(sample_ids))
+        logger.info(f"Trained {description} on {sample_size} vectors in {time.perf_counter() - start:.1f}s")
+
+    for offset in range(0, ntotal, ADD_BATCH):
+        index.add(flat.reconstruct_n(offset, min(ADD_BATCH, ntotal - offset)))
+
+    # Lets the topic gate and hybrid retrieval reconstruct (approximate) vectors
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+
+    apply_search_params(index)
+    return index
+
+
+def apply_search_params(index: faiss.Index) -> None:
+    """Set the query-time knobs (nprobe / efSearch), which need no rebuild to change"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = settings.FAISS_IVF_NPROBE
+    downcast = faiss.downcast_index(index)
+    if hasattr(downcast, "hnsw"):
+        downcast.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+
+
+def _timed_search(index: faiss.Index, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Search one query at a time, as the API does, returning labels and per-query latencies (ms)"""
+    labels = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries), dtype=np.float64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, labels[i] = index.search(query.reshape(1, -1), k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return labels, latencies
+
+
+def _latency_report(latencies: np.ndarray, bytes_per_vector: float) -> Dict[str, float]:
+    return {
+        "bytes_per_vector": round(bytes_per_vector, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def benchmark(flat: faiss.Index, candidate: Optional[faiss.Index] = None,
+              description: Optional[str] = None, k: int = 10) -> Dict[str, Any]:
+    """Memory per vector, p50/p99 search latency and recall@k of the candidate against exact search
+
+    Queries are perturbed copies of stored vectors, which resemble real queries
+    without needing the embedding model.
+    """
+    ntotal = flat.ntotal
+    n_queries = min(settings.FAISS_BENCHMARK_QUERIES, ntotal)
+    k = min(k, ntotal)
+    report: Dict[str, Any] = {"vectors": ntotal, "k": k, "queries": n_queries}
+    if n_queries <= 0 or k <= 0:
+        return report
+
+    rng = np.random.default_rng(4321)
+    queries = flat.reconstruct_batch(np.sort(rng.choice(ntotal, size=n_queries, replace=False)))
+    queries = queries + rng.normal(0, 0.05 * float(queries.std()), queries.shape).astype(np.float32)
+
+    truth, flat_latencies = _timed_search(flat, queries, k)
+    report["flat"] = _latency_report(flat_latencies, flat.d * 4)
+
+    if candidate is not None:
+        labels, latencies = _timed_search(candidate, queries, k)
+        recall = np.mean([len(np.intersect1d(labels[i], truth[i])) / k for i in range(n_queries)])
+        size = faiss.serialize_index(candidate).size
+        report[description or "candidate"] = {
+            **_latency_report(latencies, size / ntotal),
+            f"recall_at_{k}": round(float(recall), 4),
+        }
+
+    logger.info(f"Index benchmark: {report}")
+    return report
@@ -0,0 +1,157 @@
+"""
+Exact and semantic cache for RAG answers
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for exact-match lookups"""
+    return normalize_text(question).lower().rstrip("?!. ")
+
+
+class AnswerCache:
+    """TTL and size-bounded answer cache with a nearest-neighbour fallback
+
+    Lookups try the normalized question text first, then compare the question
+    embedding against every cached question with one matrix-vector product.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._vectors: Optional[np.ndarray] = None
+        self._row_keys: List[Optional[str]] = []
+        self._free_rows: List[int] = []
+        self._lock = threading.Lock()
+        self.epoch = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def get_exact(self, question: str) -> Optional[Dict[str, Any]]:
+        """Look up an answer by normalized question text"""
+        with self._lock:
+            key = normalize_question(question)
+            entry = self._live_entry(key)
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            return entry["result"]
+
+    def get_similar(self, vector: List[float]) -> Optional[Dict[str, Any]]:
+        """Look up the answer to the most similar cached question above the threshold"""
+        with self._lock:
+            if self._vectors is None or not self._entries:
+                self.misses += 1
+                return None
+
+            query = self._unit(vector)
+            if query is None or query.shape[0] != self._vectors.shape[1]:
+                self.misses += 1
+                return None
+
+            scores = self._vectors @ query
+            # Each row is visited at most once, whatever the threshold
+            for _ in range(scores.shape[0]):
+                row = int(np.argmax(scores))
+                if scores[row] < self.similarity_threshold:
+                    break
+                entry = self._live_entry(self._row_keys[row])
+                if entry is not None:
+                    self.semantic_hits += 1
+                    return entry["result"]
+                # Free and expired rows are skipped, so the scan moves on
+                scores[row] = -np.inf
+            self.misses += 1
+            return None
+
+    def put(self, question: str, vector: Optional[List[float]], result: Dict[str, Any],
+            epoch: Optional[int] = None) -> None:
+        """Cache an answer, evicting the least recently used entry when full
+
+        Answers computed before the last clear() (older ``epoch``) are dropped.
+        """
+        with self._lock:
+            if epoch is not None and epoch != self.epoch:
+                return
+            key = normalize_question(question)
+            self._remove(key)
+            if len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+            row = None
+            unit = self._unit(vector) if vector is not None else None
+            if unit is not None:
+                row = self._allocate_row(unit.shape[0])
+                if row is not None:
+                    self._vectors[row] = unit
+                    self._row_keys[row] = key
+
+            self._entries[key] = {"result": result, "row": row, "expires": time.monotonic() + self.ttl_seconds}
+
+    def clear(self) -> None:
+        """Drop every cached answer, e.g. after the index is rebuilt"""
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+            self._vectors = None
+            self._row_keys = []
+            self._free_rows = []
+        logger.info("Answer cache cleared")
+
+    def _live_entry(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            return None
+        if entry["expires"] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry["row"] is not None:
+            self._vectors[entry["row"]] = 0.0
+            self._row_keys[entry["row"]] = None
+            self._free_rows.append(entry["row"])
+
+    def _allocate_row(self, dim: int) -> Optional[int]:
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+            self._row_keys = [None] * self.max_entries
+            self._free_rows = list(range(self.max_entries - 1, -1, -1))
+        if dim != self._vectors.shape[1] or not self._free_rows:
+            return None
+        return self._free_rows.pop()
+
+    @staticmethod
+    def _unit(vector: List[float]) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit ratio and occupancy"""
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
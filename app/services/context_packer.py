@@ -0,0 +1,110 @@
+"""
+Token-budgeted context packing for RAG prompts
+"""
+from typing import Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from app.services.embedding_cache import normalize_text
+from app.utils.tokens import estimate_tokens, truncate_to_tokens
+
+# Chunks whose spans are at most this many characters apart are merged;
+# the splitter drops the whitespace it splits on
+MERGE_GAP_CHARS = 2
+
+
+class _Passage:
+    """A contiguous span of one source, built from one or more retrieved chunks"""
+
+    def __init__(self, doc: Document, score: float, rank: int):
+        self.text = doc.page_content
+        self.metadata = dict(doc.metadata)
+        self.score = score
+        self.rank = rank
+        self.chunks = 1
+        offset = doc.metadata.get("offset")
+        self.end = offset + len(self.text) if offset is not None else None
+
+    def absorb(self, doc: Document, score: float, rank: int, max_tokens: int) -> bool:
+        """Extend this passage with a chunk that overlaps or follows it; False if it can't"""
+        offset = doc.metadata.get("offset")
+        if (self.end is None or offset is None or doc.metadata.get("source") != self.metadata.get("source")
+                or offset > self.end + MERGE_GAP_CHARS):
+            return False
+        # Never merge past the budget: the best chunk would be truncated away
+        if estimate_tokens(self.text) + estimate_tokens(doc.page_content[max(self.end - offset, 0):]) > max_tokens:
+            return False
+
+        text = doc.page_content
+        overlap = self.end - offset
+        if overlap >= len(text):
+            if text not in self.text:
+                return False
+        elif overlap > 0:
+            # Offsets are only trusted when the overlapping text agrees
+            if not self.text.endswith(text[:overlap]):
+                return False
+            self.text += text[overlap:]
+        else:
+            self.text += "\n" + text
+        self.end = max(self.end, offset + len(text))
+        self.score = max(self.score, score)
+        self.rank = min(self.rank, rank)
+        self.chunks += 1
+        return True
+
+    def document(self, text: Optional[str] = None) -> Document:
+        metadata = dict(self.metadata, chunks=self.chunks)
+        return Document(page_content=text or self.text, metadata=metadata)
+
+
+def merge_passages(scored: List[Tuple[Document, float]], max_tokens: int) -> List[_Passage]:
+    """Merge overlapping and adjacent chunks of each source and drop duplicate text, in retrieval order"""
+    passages: List[_Passage] = []
+    by_source: Dict[str, List[Tuple[int, int, Document, float]]] = {}
+    for rank, (doc, score) in enumerate(scored):
+        source, offset = doc.metadata.get("source"), doc.metadata.get("offset")
+        if source is None or offset is None:
+            passages.append(_Passage(doc, score, rank))
+        else:
+            by_source.setdefault(source, []).append((offset, rank, doc, score))
+
+    for spans in by_source.values():
+        current: Optional[_Passage] = None
+        for _, rank, doc, score in sorted(spans, key=lambda span: span[0]):
+            if current is None or not current.absorb(doc, score, rank, max_tokens):
+                current = _Passage(doc, score, rank)
+                passages.append(current)
+
+    # Drop passages repeated inside a more relevant one (e.g. the same text in two files)
+    unique: List[Tuple[_Passage, str]] = []
+    for passage in sorted(passages, key=lambda passage: passage.rank):
+        text = normalize_text(passage.text).lower()
+        if not any(text in kept for _, kept in unique):
+            unique.append((passage, text))
+    return [passage for passage, _ in unique]
+
+
+def pack_context(scored: List[Tuple[Document, float]], token_budget: int,
+                 min_passage_tokens: int = 50) -> List[Tuple[Document, float]]:
+    """Passages that fit in ``token_budget`` tokens, in retrieval (or re-ranked) order
+
+    A merged passage takes the rank of its best chunk. The first passage is
+    truncated if it alone is over budget; later passages that don't fit are
+    skipped in favour of smaller, less relevant ones. Packing stops once fewer
+    than ``min_passage_tokens`` remain.
+    """
+    packed = []
+    remaining = token_budget
+    for passage in merge_passages(scored, token_budget):
+        tokens = estimate_tokens(passage.text)
+        if tokens <= remaining:
+            packed.append((passage.document(), passage.score))
+            remaining -= tokens
+        elif not packed:
+            text = truncate_to_tokens(passage.text, remaining)
+            packed.append((passage.document(text), passage.score))
+            remaining -= estimate_tokens(text)
+        if remaining < min_passage_tokens:
+            break
+    return packed
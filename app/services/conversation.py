@@ -0,0 +1,280 @@
+"""
+Server-side conversation memory: bounded per-session history and follow-up condensation
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils import metrics
+from app.utils.tokens import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"[a-z']+")
+# Words that point back at something said earlier
+_REFERENCES = frozenset(
+    "it its it's that this those these them they same else instead another".split()
+)
+_CONTINUATION = re.compile(r"^\s*(and|or|but|also|then|so|what about|how about|what if|why not)\b", re.IGNORECASE)
+# Question scaffolding that says nothing about the topic
+_FILLER = _REFERENCES | frozenset(
+    "a about also am an and any are as at be best better but by can could did do does doing for from get "
+    "good how i i'm if in is many me much my of on or should so some tell than the then there to what "
+    "when where which who why will with would you your".split()
+)
+_SHORT_QUESTION_WORDS = 3
+_TOPIC_WORDS = 8
+_SUMMARY_PREFIX = "Earlier the user asked about: "
+
+
+def topic_words(message: str) -> List[str]:
+    """Content words of a message, in order, without duplicates"""
+    words = (word for word in _WORD.findall(message.lower()) if word not in _FILLER)
+    return list(dict.fromkeys(words))
+
+
+def is_follow_up(message: str) -> bool:
+    """Whether a message probably depends on the previous turn to make sense"""
+    words = _WORD.findall(message.lower())
+    return (
+        len(words) <= _SHORT_QUESTION_WORDS
+        or bool(_CONTINUATION.match(message))
+        or any(word in _REFERENCES for word in words)
+    )
+
+
+class Session:
+    """Recent turns in a ring buffer plus a rolling summary of older ones
+
+    ``topic`` holds the content words of the latest questions, newest first,
+    and is what follow-ups are condensed against. Answers are clipped to
+    ``turn_tokens`` when stored. Once the buffer holds
+    more than ``max_turns`` turns or ``token_budget`` tokens, the oldest turns
+    are folded into the summary, which keeps only their standalone questions
+    and drops the oldest of those past ``summary_tokens``. A session therefore
+    never holds much more than ``token_budget + summary_tokens`` tokens of text.
+    """
+
+    def __init__(self, session_id: str, max_turns: int, token_budget: int,
+                 turn_tokens: int, summary_tokens: int):
+        self.id = session_id
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        # (question, answer, standalone query, tokens)
+        self.turns: Deque[Tuple[str, str, str, int]] = deque()
+        self.summary: Deque[str] = deque()
+        self.topic: Optional[str] = None
+        self.turn_count = 0
+        self.updated_at = time.time()
+
+    @property
+    def tokens(self) -> int:
+        summary = sum(estimate_tokens(topic) for topic in self.summary)
+        return summary + sum(turn[3] for turn in self.turns)
+
+    @property
+    def size_bytes(self) -> int:
+        """Approximate memory held by the session's text"""
+        text = sum(len(q) + len(a) + len(s) for q, a, s, _ in self.turns)
+        return text + sum(len(topic) for topic in self.summary) + len(self.topic or "")
+
+    def add_turn(self, question: str, answer: str, query: str) -> None:
+        """Remember a finished turn, evicting old turns into the summary as needed"""
+        answer = truncate_to_tokens(answer, self.turn_tokens)
+        self.turns.append((question, answer, query, estimate_tokens(question) + estimate_tokens(answer)))
+        self.turn_count += 1
+        words = topic_words(question)
+        if is_follow_up(question) and self.topic:
+            words += self.topic.split()
+        self.topic = " ".join(list(dict.fromkeys(words))[:_TOPIC_WORDS]) or self.topic
+
+        while len(self.turns) > 1 and (
+            len(self.turns) > self.max_turns or sum(turn[3] for turn in self.turns) > self.token_budget
+        ):
+            self._fold(self.turns.popleft())
+        self.updated_at = time.time()
+
+    def _fold(self, turn: Tuple[str, str, str, int]) -> None:
+        """Move an evicted turn into the rolling summary"""
+        self.summary.append(truncate_to_tokens(turn[2], self.summary_tokens // 2))
+        while len(self.summary) > 1 and sum(estimate_tokens(topic) for topic in self.summary) > self.summary_tokens:
+            self.summary.popleft()
+
+    def history(self) -> str:
+        """Prompt-ready transcript: summary line then recent turns"""
+        lines = []
+        if self.summary:
+            lines.append(_SUMMARY_PREFIX + "; ".join(self.summary))
+        for question, answer, _, _ in self.turns:
+            lines.append(f"User: {question}")
+            lines.append(f"GymPro AI: {answer}")
+        return "\n".join(lines)
+
+    def condense(self, message: str) -> str:
+        """Standalone retrieval query for a message, using the current topic for follow-ups"""
+        if not self.topic or not is_follow_up(message):
+            return message
+        return f"{message} ({self.topic})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "turns": [list(turn) for turn in self.turns],
+            "summary": list(self.summary),
+            "topic": self.topic,
+            "turn_count": self.turn_count,
+            "updated_at": self.updated_at
+        }
+
+    def load(self, data: Dict[str, Any]) -> "Session":
+        self.turns = deque(tuple(turn) for turn in data.get("turns", []))
+        self.summary = deque(data.get("summary", []))
+        self.topic = data.get("topic")
+        self.turn_count = data.get("turn_count", len(self.turns))
+        self.updated_at = data.get("updated_at", time.time())
+        return self
+
+
+class SessionStore:
+    """LRU- and TTL-bounded sessions in memory, optionally backed by SQLite
+
+    With ``db_path`` set, every save is written through to SQLite, so sessions
+    survive restarts and LRU eviction, and gunicorn workers sharing the file see
+    each other's turns: a lookup re-reads a row only if it is newer than the
+    copy held in memory.
+    """
+
+    def __init__(self, max_sessions: int, ttl_seconds: float, max_turns: int, token_budget: int,
+                 turn_tokens: int, summary_tokens: int, db_path: Optional[Path] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        self.db_path = db_path
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+        self._writes = 0
+        self.evictions = 0
+
+    def _new(self, session_id: str) -> Session:
+        return Session(session_id, self.max_turns, self.token_budget, self.turn_tokens, self.summary_tokens)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections don't survive fork, so each worker opens its own
+        if self._db is None or self._db_pid != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.db_path), timeout=5, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, session_id: str) -> Session:
+        """Session for an id, created empty if unknown or expired"""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.updated_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                session = None
+
+            if self.db_path is not None:
+                try:
+                    row = self._connection().execute(
+                        "SELECT data FROM sessions WHERE id = ? AND updated_at > ? AND updated_at > ?",
+                        (session_id, session.updated_at if session else 0.0, now - self.ttl_seconds)
+                    ).fetchone()
+                    if row:
+                        session = self._new(session_id).load(json.loads(row[0]))
+                except sqlite3.Error as e:
+                    logger.warning(f"Session store read failed, using memory only: {e}")
+
+            if session is None:
+                session = self._new(session_id)
+            self._remember(session)
+            return session
+
+    def record(self, session: Session, question: str, answer: str, query: str) -> None:
+        """Add a finished turn to a session and save it"""
+        with self._lock:
+            session.add_turn(question, answer, query)
+            self._remember(session)
+            if self.db_path is not None:
+                self._write(session)
+
+    def _remember(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def _write(self, session: Session) -> None:
+        try:
+            db = self._connection()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                    (session.id, json.dumps(session.to_dict()), session.updated_at)
+                )
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+        except sqlite3.Error as e:
+            logger.warning(f"Session store write failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Session counts and the memory they hold"""
+        with self._lock:
+            sizes: List[int] = [session.size_bytes for session in self._sessions.values()]
+            tokens = [session.tokens for session in self._sessions.values()]
+        return {
+            "backend": "sqlite" if self.db_path is not None else "memory",
+            "sessions": len(sizes),
+            "max_sessions": self.max_sessions,
+            "evictions": self.evictions,
+            "memory_bytes": sum(sizes),
+            "max_session_bytes": max(sizes, default=0),
+            "max_session_tokens": max(tokens, default=0),
+            "token_budget": self.token_budget + self.summary_tokens
+        }
+
+    def update_metrics(self) -> None:
+        """Refresh the session gauges"""
+        stats = self.get_stats()
+        metrics.sessions.set(stats["sessions"])
+        metrics.session_memory_bytes.set(stats["memory_bytes"])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None and self._db_pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+
+# Create global session store instance
+session_store = SessionStore(
+    max_sessions=settings.SESSION_MAX_SESSIONS,
+    ttl_seconds=settings.SESSION_TTL_SECONDS,
+    max_turns=settings.SESSION_MAX_TURNS,
+    token_budget=settings.SESSION_TOKEN_BUDGET,
+    turn_tokens=settings.SESSION_TURN_MAX_TOKENS,
+    summary_tokens=settings.SESSION_SUMMARY_TOKENS,
+    db_path=Path(settings.SESSION_DB_PATH) if settings.SESSION_DB_PATH else None
+)
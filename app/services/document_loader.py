@@ -0,0 +1,156 @@
+"""
+Streaming loader for a directory-based gym knowledge base
+"""
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_SUFFIXES = {".md", ".markdown"}
+TEXT_SUFFIXES = {".txt"}
+JSONL_SUFFIXES = {".jsonl"}
+
+# How many chunks worth of text a block holds before it is split
+BUFFER_CHUNKS = 8
+
+_MARKDOWN_HEADING = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$")
+_CAPS_HEADING = re.compile(r"^[A-Z0-9][A-Z0-9 &/,'()\-]{2,79}$")
+
+# A block of text: (character offset in the file, text, [(position in text, heading)])
+Block = Tuple[int, str, List[Tuple[int, str]]]
+
+
+def iter_corpus_files(data_dir: Path = None) -> Iterator[Path]:
+    """Walk the data directory for supported corpus files in a stable order"""
+    data_dir = Path(data_dir or settings.DATA_DIR)
+    if not data_dir.exists():
+        return
+    skip = Path(settings.VECTOR_STORE_PATH).resolve()
+    for path in sorted(data_dir.rglob("*")):
+        if not path.is_file() or path.suffix.lower() not in settings.CORPUS_FILE_TYPES:
+            continue
+        relative = path.relative_to(data_dir)
+        if any(part.startswith(".") for part in relative.parts):
+            continue
+        if skip == path.resolve() or skip in path.resolve().parents:
+            continue
+        yield path
+
+
+def _heading(line: str, markdown: bool) -> Optional[str]:
+    """Return the heading text if the line is a section heading"""
+    stripped = line.strip()
+    if markdown:
+        match = _MARKDOWN_HEADING.match(stripped)
+        return match.group(1) if match else None
+    # Plain-text corpora use ALL CAPS lines as section titles
+    if _CAPS_HEADING.match(stripped) and any(c.isalpha() for c in stripped):
+        return stripped
+    return None
+
+
+def _iter_text_blocks(path: Path) -> Iterator[Block]:
+    """Yield blocks of a text or markdown file, reading line by line
+
+    Blocks hold about BUFFER_CHUNKS chunks worth of text so memory stays
+    bounded however large the file is; the headings seen inside each block are
+    recorded so every chunk can be attributed to its section.
+    """
+    markdown = path.suffix.lower() in MARKDOWN_SUFFIXES
+    limit = settings.CHUNK_SIZE * BUFFER_CHUNKS
+    heading: Optional[str] = None
+    buffer: List[str] = []
+    headings: List[Tuple[int, str]] = []
+    buffer_len = 0
+    buffer_offset = 0
+    offset = 0
+
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if buffer_len >= limit:
+                yield buffer_offset, "".join(buffer), headings
+                buffer, buffer_len = [], 0
+                # The next block starts inside the current section
+                headings = [(0, heading)] if heading else []
+
+            title = _heading(line, markdown)
+            if title is not None:
+                heading = title
+                headings.append((buffer_len, title))
+
+            if not buffer_len:
+                buffer_offset = offset
+            buffer.append(line)
+            buffer_len += len(line)
+            offset += len(line)
+
+    if buffer_len:
+        yield buffer_offset, "".join(buffer), headings
+
+
+def _iter_jsonl_blocks(path: Path) -> Iterator[Block]:
+    """Yield one block per JSONL record with a text/content field"""
+    offset = 0
+    with open(path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping invalid JSON on line {line_number} of {path.name}")
+                continue
+            text = record.get("text") or record.get("content") if isinstance(record, dict) else None
+            if not text:
+                continue
+            if not isinstance(text, str):
+                logger.warning(f"Skipping non-text record on line {line_number} of {path.name}")
+                continue
+            heading = record.get("title") or record.get("heading") or record.get("section")
+            yield line_offset, text, [(0, heading)] if isinstance(heading, str) and heading else []
+
+
+def iter_blocks(path: Path) -> Iterator[Block]:
+    """Yield (offset, text, headings) blocks for any supported file type"""
+    if path.suffix.lower() in JSONL_SUFFIXES:
+        return _iter_jsonl_blocks(path)
+    return _iter_text_blocks(path)
+
+
+def _section_at(headings: List[Tuple[int, str]], position: int, length: int) -> Optional[str]:
+    """Heading in force where a chunk starts, else the first heading inside the chunk"""
+    section = None
+    for heading_position, title in headings:
+        if heading_position >= position + length:
+            break
+        if heading_position <= position or section is None:
+            section = title
+    return section
+
+
+def iter_chunks(path: Path, source: str) -> Iterator[Document]:
+    """Stream chunk documents for one file with source, section and offset metadata"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=settings.CHUNK_SIZE,
+        chunk_overlap=settings.CHUNK_OVERLAP,
+        length_function=len,
+        add_start_index=True,
+    )
+    for offset, text, headings in iter_blocks(path):
+        for chunk in text_splitter.create_documents([text]):
+            start = chunk.metadata["start_index"]
+            metadata = {"source": source, "offset": offset + start}
+            section = _section_at(headings, start, len(chunk.page_content))
+            if section:
+                metadata["section"] = section
+            yield Document(page_content=chunk.page_content, metadata=metadata)
@@ -0,0 +1,372 @@
+"""
+Persistent, content-addressed cache for embedding vectors
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+from app.services.providers import aembed_queries
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, always the writer
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.u64"
+INDEX_FILE = "index.json"
+LOCK_FILE = "cache.lock"
+
+# Embedding task kinds: Gemini embeds questions and stored chunks differently
+QUERY = "query"
+DOCUMENT = "document"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different inputs share a cache entry"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def key_fingerprint(key: str) -> int:
+    """Non-zero 64-bit fingerprint of a cache key; 0 marks a row being written"""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+class EmbeddingCacheStore:
+    """LRU-bounded store of float32 vectors in a flat file with a JSON index sidecar
+
+    Rows are fixed-size slots in ``vectors.f32``; an evicted key hands its slot
+    to the next insert, so the file never grows past ``max_entries`` rows.
+    Only the process holding ``cache.lock`` writes to disk; other processes
+    map the files read-only and keep their own additions in memory.
+
+    A reader's mapping still shows rows the writer rewrites after the reader
+    loaded the index, so ``keys.u64`` holds a fingerprint of the key stored in
+    each row. Readers check it on every lookup and treat a reused row as a miss.
+    """
+
+    def __init__(self, path: Path, max_entries: int, flush_every: int = 32):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.dim: Optional[int] = None
+        self._rows: "OrderedDict[str, int]" = OrderedDict()
+        self._free_rows: List[int] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._row_keys: Optional[np.ndarray] = None
+        # Additions of a process that can't write to disk
+        self._local: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._capacity = 0
+        self._dirty = 0
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self.writable = False
+        self._open()
+
+    def _open(self) -> None:
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.writable = self._acquire_writer_lock()
+            self._load()
+        except Exception as e:
+            logger.warning(f"Embedding cache unavailable on disk, using memory only: {e}")
+            self.writable = False
+            self._rows.clear()
+            self._vectors = None
+            self._row_keys = None
+            self._capacity = 0
+
+    def _acquire_writer_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        self._lock_file = open(self.path / LOCK_FILE, "a+")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            logger.info("Embedding cache is owned by another process, opening read-only")
+            return False
+
+    def _load(self) -> None:
+        index_path = self.path / INDEX_FILE
+        vectors_path = self.path / VECTORS_FILE
+        if not index_path.exists() or not vectors_path.exists():
+            return
+
+        with open(index_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+
+        self.dim = int(meta["dim"])
+        rows = int(os.path.getsize(vectors_path) // (4 * self.dim))
+        keys_path = self.path / KEYS_FILE
+        if not self.writable and (not keys_path.exists() or os.path.getsize(keys_path) < rows * 8):
+            logger.info("Embedding cache has no row fingerprints yet, starting empty until the writer adds them")
+            self.dim = None
+            return
+
+        mode = "r+" if self.writable else "r"
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(rows, self.dim))
+        if self.writable:
+            self._map_row_keys(rows)
+        else:
+            self._row_keys = np.memmap(keys_path, dtype=np.uint64, mode="r", shape=(rows,))
+        self._capacity = rows
+
+        # Entries are stored oldest-first, which restores the LRU order
+        for key, row in zip(meta["keys"], meta["rows"]):
+            if row < rows:
+                self._rows[key] = row
+        if self.writable:
+            # Caches written before row fingerprints existed get them here;
+            # rows whose fingerprint is already right are rewritten unchanged
+            fingerprints = np.zeros(rows, dtype=np.uint64)
+            for key, row in self._rows.items():
+                fingerprints[row] = key_fingerprint(key)
+            self._row_keys[:] = fingerprints
+            self._row_keys.flush()
+        used = set(self._rows.values())
+        self._free_rows = [row for row in range(rows) if row not in used]
+        logger.info(f"Loaded embedding cache with {len(self._rows)} entries")
+
+    def _map_row_keys(self, rows: int) -> None:
+        keys_path = self.path / KEYS_FILE
+        with open(keys_path, "ab") as file:
+            file.truncate(rows * 8)
+        self._row_keys = np.memmap(keys_path, dtype=np.uint64, mode="r+", shape=(rows,))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return a cached vector and mark it most recently used"""
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+                return vector.copy()
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            vector = np.array(self._vectors[row])
+            # Read the fingerprint after the vector: the writer clears it before rewriting a row
+            if not self.writable and self._row_keys[row] != key_fingerprint(key):
+                del self._rows[key]
+                return None
+            self._rows.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector: List[float]) -> None:
+        """Insert a vector, evicting the least recently used entry when full"""
+        with self._lock:
+            vector = np.asarray(vector, dtype=np.float32)
+            if self.dim is None:
+                self.dim = int(vector.shape[0])
+            if vector.shape[0] != self.dim:
+                return
+            if not self.writable:
+                self._local[key] = vector
+                self._local.move_to_end(key)
+                while len(self._local) > self.max_entries:
+                    self._local.popitem(last=False)
+                return
+
+            row = self._rows.pop(key, None)
+            if row is None:
+                row = self._allocate_row()
+            self._row_keys[row] = 0
+            self._vectors[row] = vector
+            self._row_keys[row] = key_fingerprint(key)
+            self._rows[key] = row
+            self._dirty += 1
+            if self._dirty >= self.flush_every:
+                self.flush()
+
+    def _allocate_row(self) -> int:
+        if self._free_rows:
+            return self._free_rows.pop()
+        if len(self._rows) >= self.max_entries:
+            _, row = self._rows.popitem(last=False)
+            return row
+        self._grow(min(self.max_entries, max(64, self._capacity * 2)))
+        return self._free_rows.pop()
+
+    def _grow(self, capacity: int) -> None:
+        vectors_path = self.path / VECTORS_FILE
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._row_keys.flush()
+        with open(vectors_path, "ab") as file:
+            file.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._map_row_keys(capacity)
+        self._free_rows.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
+
+    def flush(self) -> None:
+        """Persist vectors and the index sidecar"""
+        with self._lock:
+            if not self.writable or self._vectors is None or not self._dirty:
+                return
+            try:
+                self._vectors.flush()
+                self._row_keys.flush()
+                meta = {
+                    "dim": self.dim,
+                    "keys": list(self._rows.keys()),
+                    "rows": list(self._rows.values()),
+                }
+                tmp_path = self.path / f"{INDEX_FILE}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    json.dump(meta, file)
+                os.replace(tmp_path, self.path / INDEX_FILE)
+                self._dirty = 0
+            except Exception as e:
+                logger.warning(f"Could not flush embedding cache: {e}")
+
+    def close(self) -> None:
+        """Flush, drop the mapped file and release the writer lock"""
+        with self._lock:
+            self.flush()
+            self._vectors = None
+            self._row_keys = None
+            self._rows.clear()
+            self._local.clear()
+            self._free_rows = []
+            self._capacity = 0
+            self.writable = False
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def reopen(self) -> None:
+        """Reload from disk and compete for the writer lock again, e.g. in a forked worker"""
+        with self._lock:
+            self.close()
+            self._open()
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._local)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an on-disk cache"""
+
+    def __init__(self, base: Embeddings, model_name: str, store: EmbeddingCacheStore):
+        self.base = base
+        self.model_name = model_name
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, text: str, kind: str = DOCUMENT) -> str:
+        """Content address for a text under the wrapped model and task kind"""
+        payload = f"{self.model_name}\0{kind}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()[:32]
+
+    def lookup(self, texts: List[str], kind: str = DOCUMENT):
+        """Cache keys, cached vectors (None where missing) and the indices to embed"""
+        keys = [self.cache_key(text, kind) for text in texts]
+        vectors: List[Optional[List[float]]] = []
+        missing: List[int] = []
+        for i, key in enumerate(keys):
+            cached = self.store.get(key)
+            vectors.append(cached.tolist() if cached is not None else None)
+            if cached is None:
+                missing.append(i)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return keys, vectors, missing
+
+    def fill(self, keys, vectors, missing, embedded: List[List[float]]) -> List[List[float]]:
+        """Store freshly embedded vectors under the keys (and so the task kind) ``lookup`` gave"""
+        for i, vector in zip(missing, embedded):
+            vectors[i] = list(vector)
+            self.store.put(keys[i], vector)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self.lookup(texts)
+        if missing:
+            embedded = self.base.embed_documents([texts[i] for i in missing])
+            self.fill(keys, vectors, missing, embedded)
+            self.store.flush()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = self.lookup([text], QUERY)
+        if missing:
+            self.fill(keys, vectors, missing, [self.base.embed_query(text)])
+        return vectors[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self.lookup(texts)
+        if missing:
+            embedded = await self.base.aembed_documents([texts[i] for i in missing])
+            self.fill(keys, vectors, missing, embedded)
+            self.store.flush()
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = self.lookup([text], QUERY)
+        if missing:
+            self.fill(keys, vectors, missing, [await self.base.aembed_query(text)])
+        return vectors[0]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Query embeddings for several questions, with the misses embedded together"""
+        keys, vectors, missing = self.lookup(texts, QUERY)
+        if missing:
+            embedded = await aembed_queries(self.base, [texts[i] for i in missing])
+            self.fill(keys, vectors, missing, embedded)
+        return vectors
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.store),
+            "max_entries": self.store.max_entries,
+            "persistent": self.store.writable,
+        }
+
+
+_stores: Dict[str, EmbeddingCacheStore] = {}
+
+
+def get_cache_store() -> EmbeddingCacheStore:
+    """Shared store per cache path, so re-initialization keeps the open cache"""
+    key = str(settings.EMBEDDING_CACHE_PATH)
+    if key not in _stores:
+        _stores[key] = EmbeddingCacheStore(
+            settings.EMBEDDING_CACHE_PATH,
+            max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+        )
+    return _stores[key]
+
+
+def close_cache_stores() -> None:
+    """Release every open store; a server master does this before forking workers"""
+    for store in _stores.values():
+        store.close()
+
+
+def reopen_cache_stores() -> None:
+    """Reopen every store in this process, so one worker becomes the disk writer"""
+    for store in _stores.values():
+        store.reopen()
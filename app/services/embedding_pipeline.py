@@ -0,0 +1,132 @@
+"""
+Batched, concurrent embedding of chunks for index builds
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+from app.services.embedding_cache import DOCUMENT, CachedEmbeddings
+
+logger = logging.getLogger(__name__)
+
+_RATE_LIMIT_MARKERS = ("429", "resource exhausted", "resourceexhausted", "rate limit", "quota")
+_TRANSIENT_MARKERS = ("500", "503", "unavailable", "deadline", "timeout", "timed out", "connection")
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Whether a provider error means we are sending requests too fast"""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _RATE_LIMIT_MARKERS)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a provider error is worth retrying"""
+    text = f"{type(error).__name__} {error}".lower()
+    return is_rate_limited(error) or any(marker in text for marker in _TRANSIENT_MARKERS)
+
+
+class EmbeddingPipeline:
+    """Embeds chunks in provider-sized batches on a bounded thread pool
+
+    Each finished batch is written to the embedding cache and flushed, which is
+    the build checkpoint: an interrupted build re-plans the same documents and
+    only the batches that never completed reach the provider again.
+    """
+
+    def __init__(self, embeddings: Embeddings,
+                 batch_size: int = settings.EMBEDDING_BATCH_SIZE,
+                 max_workers: int = settings.EMBEDDING_CONCURRENCY,
+                 max_retries: int = settings.EMBEDDING_MAX_RETRIES,
+                 backoff_seconds: float = settings.EMBEDDING_RETRY_BACKOFF_SECONDS):
+        self.embeddings = embeddings
+        self.cache = embeddings if isinstance(embeddings, CachedEmbeddings) else None
+        self.base = self.cache.base if self.cache else embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.embedded = 0
+        self.cached = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embed")
+
+    def __enter__(self) -> "EmbeddingPipeline":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the worker threads"""
+        self._executor.shutdown(wait=True)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, serving cached ones and batching the rest across workers"""
+        start = time.perf_counter()
+        if self.cache:
+            keys, vectors, missing = self.cache.lookup(texts, DOCUMENT)
+        else:
+            keys, vectors, missing = None, [None] * len(texts), list(range(len(texts)))
+        self.cached += len(texts) - len(missing)
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        futures = {
+            self._executor.submit(self._embed_batch, [texts[i] for i in batch]): batch
+            for batch in batches
+        }
+        try:
+            for future in as_completed(futures):
+                batch = futures[future]
+                embedded = future.result()
+                if self.cache:
+                    self.cache.fill(keys, vectors, batch, embedded)
+                    self.cache.store.flush()
+                else:
+                    for i, vector in zip(batch, embedded):
+                        vectors[i] = list(vector)
+                self.embedded += len(batch)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            self.seconds += time.perf_counter() - start
+
+        return vectors
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, backing off and retrying on rate limits and transient errors"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.base.embed_documents(texts)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt)
+                if is_rate_limited(e):
+                    delay *= 2
+                delay *= 1 + random.random() * 0.25
+                self.retries += 1
+                logger.warning(f"Embedding batch of {len(texts)} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    @property
+    def chunks_per_sec(self) -> float:
+        """Chunks processed (embedded or cached) per second of pipeline time"""
+        return round((self.embedded + self.cached) / self.seconds, 1) if self.seconds else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Throughput and retry counters for the build so far"""
+        return {
+            "chunks_embedded": self.embedded,
+            "chunks_cached": self.cached,
+            "retries": self.retries,
+            "seconds": round(self.seconds, 3),
+            "chunks_per_sec": self.chunks_per_sec,
+        }
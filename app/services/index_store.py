@@ -0,0 +1,237 @@
+"""
+On-disk persistence for the FAISS vector store
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+from app.services.lexical_index import LexicalIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, no cross-process lock needed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so old stores are rebuilt
+STORE_FORMAT_VERSION = "3"
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+MANIFEST_FILE = "manifest.json"
+LEXICAL_FILE = "bm25.npz"
+ANN_PREFIX = "ann-"
+LOCK_FILE = ".write.lock"
+
+
+class IndexStore:
+    """Persists FAISS indexes keyed by a fingerprint of the settings that shape them
+
+    Corpus changes are applied incrementally on top of the stored index (see
+    ``app.services.ingestion``); only a settings change starts a fresh store.
+    """
+
+    def __init__(self, root: Path = settings.VECTOR_STORE_PATH):
+        self.root = Path(root)
+
+    def fingerprint(self) -> str:
+        """Hash the settings that make stored vectors incompatible when changed"""
+        digest = hashlib.sha256()
+        digest.update(f"format={STORE_FORMAT_VERSION}\n".encode())
+        digest.update(f"embedding_model={settings.embedding_model_name}\n".encode())
+        digest.update(f"chunk_size={settings.CHUNK_SIZE}\n".encode())
+        digest.update(f"chunk_overlap={settings.CHUNK_OVERLAP}\n".encode())
+        return digest.hexdigest()[:16]
+
+    def _store_dir(self, fingerprint: str) -> Path:
+        return self.root / fingerprint
+
+    def exists(self, fingerprint: str) -> bool:
+        """Check whether a complete store exists for the fingerprint"""
+        store_dir = self._store_dir(fingerprint)
+        return all((store_dir / name).exists() for name in (INDEX_FILE, DOCSTORE_FILE, MANIFEST_FILE))
+
+    def load(self, fingerprint: str, embeddings: Embeddings, writable: bool = False) -> Optional[FAISS]:
+        """Load a persisted vector store
+
+        Read-only loads memory-map the FAISS index when possible; ``writable``
+        loads a private in-RAM copy that can be modified and saved back.
+        """
+        if not self.exists(fingerprint):
+            return None
+
+        store_dir = self._store_dir(fingerprint)
+        try:
+            if writable:
+                index = faiss.read_index(str(store_dir / INDEX_FILE))
+            else:
+                index = self._read_index(store_dir / INDEX_FILE)
+
+            # The docstore pickle is written by save() below, never by users
+            with open(store_dir / DOCSTORE_FILE, "rb") as file:
+                docstore, index_to_docstore_id = pickle.load(file)
+
+            logger.info(f"Loaded persisted FAISS index {fingerprint} ({index.ntotal} vectors)")
+            return FAISS(
+                embedding_function=embeddings,
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id=index_to_docstore_id,
+            )
+
+        except Exception as e:
+            logger.warning(f"Could not load persisted index {fingerprint}: {e}")
+            return None
+
+    def _read_index(self, path: Path) -> faiss.Index:
+        """Read an index with read-only mmap so forked workers share its pages"""
+        if not settings.VECTOR_STORE_MMAP:
+            return faiss.read_index(str(path))
+
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(str(path), mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning(f"Memory-mapped read not supported for {path.name}, loading into RAM: {e}")
+            return faiss.read_index(str(path))
+
+    def load_manifest(self, fingerprint: str) -> Dict[str, Any]:
+        """Read the per-document manifest stored next to the index"""
+        path = self._store_dir(fingerprint) / MANIFEST_FILE
+        if not self.exists(fingerprint):
+            return {"documents": {}}
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except Exception as e:
+            logger.warning(f"Could not read index manifest, rebuilding: {e}")
+            return {"documents": {}}
+
+    def save(self, fingerprint: str, vectorstore: FAISS, manifest: Dict[str, Any],
+             lexical: Optional[LexicalIndex] = None) -> bool:
+        """Persist a vector store, its manifest and BM25 index, replacing the previous version
+
+        Processes that memory-mapped the old files keep reading them until
+        they reload; the files are unlinked, not overwritten in place.
+        """
+        store_dir = self._store_dir(fingerprint)
+        tmp_dir = self.root / f".{fingerprint}.{os.getpid()}.tmp"
+        old_dir = self.root / f".{fingerprint}.{os.getpid()}.old"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            vectorstore.save_local(str(tmp_dir))
+            with open(tmp_dir / MANIFEST_FILE, "w", encoding="utf-8") as file:
+                json.dump(manifest, file)
+            if lexical is not None:
+                lexical.save(tmp_dir / LEXICAL_FILE)
+
+            if store_dir.exists():
+                os.replace(store_dir, old_dir)
+            os.replace(tmp_dir, store_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+            logger.info(f"Persisted FAISS index {fingerprint} to {store_dir}")
+            self.prune(keep=fingerprint)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error persisting FAISS index: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+
+    def load_lexical(self, fingerprint: str) -> Optional[LexicalIndex]:
+        """Read the BM25 index stored next to the vector index"""
+        path = self._store_dir(fingerprint) / LEXICAL_FILE
+        if not path.exists():
+            return None
+        try:
+            return LexicalIndex.load(path)
+        except Exception as e:
+            logger.warning(f"Could not load BM25 index {fingerprint}: {e}")
+            return None
+
+    def save_lexical(self, fingerprint: str, lexical: LexicalIndex) -> bool:
+        """Add a BM25 index to an existing store (e.g. one saved before hybrid retrieval)"""
+        store_dir = self._store_dir(fingerprint)
+        tmp_path = store_dir / f".{LEXICAL_FILE}.{os.getpid()}.tmp"
+        try:
+            lexical.save(tmp_path)
+            os.replace(tmp_path, store_dir / LEXICAL_FILE)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not persist BM25 index {fingerprint}: {e}")
+            with contextlib.suppress(OSError):
+                tmp_path.unlink()
+            return False
+
+    def _ann_file(self, fingerprint: str, description: str) -> Path:
+        name = description.replace(",", "_").replace("/", "_")
+        return self._store_dir(fingerprint) / f"{ANN_PREFIX}{name}.faiss"
+
+    def load_ann(self, fingerprint: str, description: str) -> Optional[faiss.Index]:
+        """Read a serving index of the given factory description, memory-mapped when possible"""
+        path = self._ann_file(fingerprint, description)
+        if not path.exists():
+            return None
+        try:
+            return self._read_index(path)
+        except Exception as e:
+            logger.warning(f"Could not load {description} index {fingerprint}: {e}")
+            return None
+
+    def save_ann(self, fingerprint: str, description: str, index: faiss.Index) -> bool:
+        """Store a serving index next to the flat one, dropping indexes of other types"""
+        path = self._ann_file(fingerprint, description)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            faiss.write_index(index, str(tmp_path))
+            os.replace(tmp_path, path)
+            for entry in path.parent.glob(f"{ANN_PREFIX}*.faiss"):
+                if entry != path:
+                    entry.unlink()
+            return True
+        except Exception as e:
+            logger.warning(f"Could not persist {description} index {fingerprint}: {e}")
+            with contextlib.suppress(OSError):
+                tmp_path.unlink()
+            return False
+
+    @contextlib.contextmanager
+    def write_lock(self) -> Iterator[None]:
+        """Serialize index updates across worker processes"""
+        if fcntl is None:
+            yield
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / LOCK_FILE, "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def prune(self, keep: str) -> None:
+        """Remove stores built with older settings"""
+        if not self.root.exists():
+            return
+        for entry in self.root.iterdir():
+            if entry.name != keep and (entry / INDEX_FILE).exists():
+                shutil.rmtree(entry, ignore_errors=True)
+                logger.info(f"Removed stale FAISS index {entry.name}")
+
+
+# Create global index store instance
+index_store = IndexStore()
@@ -0,0 +1,269 @@
+"""
+Incremental corpus ingestion into the persisted FAISS index
+"""
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+from app.services import ann_index
+from app.services.document_loader import iter_chunks, iter_corpus_files
+from app.services.embedding_pipeline import EmbeddingPipeline
+from app.services.index_store import IndexStore, index_store
+from app.services.lexical_index import LexicalIndex
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+ProgressCallback = Callable[..., None]
+
+
+def search_k() -> int:
+    """How many neighbours a query asks the vector index for"""
+    return settings.HYBRID_CANDIDATES if settings.HYBRID_RETRIEVAL else settings.SIMILARITY_SEARCH_K
+
+
+def corpus_files() -> List[Path]:
+    """Files that make up the knowledge base"""
+    return list(iter_corpus_files())
+
+
+def source_name(path: Path) -> str:
+    """Stable identifier for a corpus file, relative to the data directory"""
+    try:
+        return Path(path).resolve().relative_to(settings.DATA_DIR.resolve()).as_posix()
+    except ValueError:
+        return Path(path).as_posix()
+
+
+def file_hash(path: Path) -> str:
+    """Content hash of a corpus file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_document_chunks(path: Path) -> Iterator[Document]:
+    """Stream one corpus file as chunk documents with stable content-hash ids"""
+    source = source_name(path)
+    seen: Dict[str, int] = {}
+    for document in iter_chunks(path, source):
+        chunk_id = chunk_hash(source, document.page_content)
+        # Identical chunks within one file still need distinct ids
+        occurrence = seen.get(chunk_id, 0)
+        seen[chunk_id] = occurrence + 1
+        if occurrence:
+            chunk_id = chunk_hash(source, document.page_content, occurrence)
+        document.metadata["chunk_id"] = chunk_id
+        yield document
+
+
+def split_document(path: Path) -> List[Document]:
+    """Split one corpus file into chunk documents"""
+    return list(iter_document_chunks(path))
+
+
+def chunk_hash(source: str, text: str, occurrence: int = 0) -> str:
+    """Content address of a chunk within its source document"""
+    payload = f"{source}\0{occurrence}\0{text}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+class CorpusIngestor:
+    """Keeps the persisted index in step with the corpus, embedding only what changed"""
+
+    def __init__(self, store: IndexStore = index_store):
+        self.store = store
+        self.last_build: Optional[Dict[str, Any]] = None
+
+    def sync(self, embeddings: Embeddings, report: Optional[ProgressCallback] = None) -> Tuple[Optional[FAISS], str]:
+        """Bring the persisted index up to date and return it with its corpus version"""
+        report = report or (lambda stage, **details: None)
+        fingerprint = self.store.fingerprint()
+
+        files = corpus_files()
+        if not files:
+            logger.error("No corpus files found")
+            return None, ""
+        current = {source_name(path): (path, file_hash(path)) for path in files}
+
+        manifest = self.store.load_manifest(fingerprint)
+        changed, removed = self._plan(manifest, current)
+        if not changed and not removed and self.store.exists(fingerprint):
+            vectorstore = self.store.load(fingerprint, embeddings)
+            if vectorstore is not None:
+                return vectorstore, self._version(manifest)
+            # An unreadable index falls through to a rebuild instead of failing on every retry
+            logger.warning("Persisted index is up to date but could not be loaded, rebuilding it")
+
+        with self.store.write_lock():
+            # Another worker may have applied the same changes (or rebuilt it) while we waited
+            manifest = self.store.load_manifest(fingerprint)
+            changed, removed = self._plan(manifest, current)
+            if not changed and not removed and self.store.exists(fingerprint):
+                vectorstore = self.store.load(fingerprint, embeddings)
+                if vectorstore is not None:
+                    return vectorstore, self._version(manifest)
+
+            report("loading_corpus", changed_documents=len(changed), removed_documents=len(removed))
+            vectorstore = self.store.load(fingerprint, embeddings, writable=True)
+            if vectorstore is None:
+                manifest = {"documents": {}}
+                changed = sorted(current)
+                removed = []
+
+            documents = manifest["documents"]
+            stale_ids: List[str] = []
+            batch: List[Document] = []
+            added = 0
+
+            with EmbeddingPipeline(embeddings) as pipeline:
+                def flush_batch() -> None:
+                    nonlocal vectorstore, batch, added
+                    if not batch:
+                        return
+                    texts = [doc.page_content for doc in batch]
+                    text_embeddings = list(zip(texts, pipeline.embed(texts)))
+                    metadatas = [doc.metadata for doc in batch]
+                    ids = [doc.metadata["chunk_id"] for doc in batch]
+                    if vectorstore is None:
+                        vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+                    else:
+                        vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                    added += len(batch)
+                    report("embedding", chunks_added=added, chunks_per_sec=pipeline.chunks_per_sec)
+                    batch = []
+
+                for source in removed:
+                    stale_ids.extend(documents.pop(source)["chunks"])
+
+                # Chunks stream through in batches, so memory is bounded by the
+                # batch size rather than the size of the changed documents
+                for source in changed:
+                    path, digest = current[source]
+                    old_ids = set(documents.get(source, {}).get("chunks", []))
+                    chunk_ids = []
+                    for document in iter_document_chunks(path):
+                        chunk_ids.append(document.metadata["chunk_id"])
+                        if document.metadata["chunk_id"] in old_ids:
+                            # Ids are content-only, so a kept chunk may have moved within the file
+                            self._refresh_metadata(vectorstore, document)
+                        else:
+                            batch.append(document)
+                            if len(batch) >= settings.LOADER_BATCH_SIZE:
+                                flush_batch()
+                    stale_ids.extend(old_ids - set(chunk_ids))
+                    documents[source] = {"hash": digest, "chunks": chunk_ids}
+                flush_batch()
+
+            self.last_build = {**pipeline.get_stats(), "chunks_added": added, "chunks_deleted": len(stale_ids)}
+
+            if vectorstore is None:
+                logger.error("No documents loaded")
+                return None, ""
+            if stale_ids:
+                vectorstore.delete(stale_ids)
+            logger.info(f"Ingested {added} new chunks at {pipeline.chunks_per_sec} chunks/sec "
+                        f"({pipeline.cached} from cache, {pipeline.retries} retries), "
+                        f"deleted {len(stale_ids)} stale chunks")
+
+            manifest = {"version": MANIFEST_VERSION, "documents": documents}
+
+            report("building_lexical_index")
+            lexical = LexicalIndex.from_vectorstore(vectorstore)
+
+            # Reload from disk so workers share the memory-mapped copy
+            report("persisting_index")
+            if self.store.save(fingerprint, vectorstore, manifest, lexical):
+                vectorstore = self.store.load(fingerprint, embeddings) or vectorstore
+
+            if ann_index.describe(vectorstore.index.ntotal, vectorstore.index.d) is None:
+                report("benchmarking_index")
+                self.last_build["index"] = ann_index.benchmark(vectorstore.index, k=search_k())
+            return vectorstore, self._version(manifest)
+
+    @staticmethod
+    def _refresh_metadata(vectorstore: FAISS, document: Document) -> None:
+        """Give a stored chunk the position metadata of its re-ingested copy"""
+        stored = vectorstore.docstore.search(document.metadata["chunk_id"])
+        if isinstance(stored, Document):
+            stored.metadata = dict(document.metadata)
+
+    def serving_index(self, vectorstore: FAISS, report: Optional[ProgressCallback] = None) -> FAISS:
+        """Serve from the configured ANN index, deriving it from the flat vectors if needed
+
+        The flat index stays the source of truth for incremental updates; the
+        ANN index is rebuilt from it (no re-embedding) whenever the store changes.
+        """
+        report = report or (lambda stage, **details: None)
+        flat = vectorstore.index
+        description = ann_index.describe(flat.ntotal, flat.d)
+        if description is None:
+            return vectorstore
+
+        fingerprint = self.store.fingerprint()
+        index = self.store.load_ann(fingerprint, description)
+        if index is None or index.ntotal != flat.ntotal:
+            with self.store.write_lock():
+                index = self.store.load_ann(fingerprint, description)
+                if index is None or index.ntotal != flat.ntotal:
+                    report("building_ann_index", description=description)
+                    try:
+                        index = ann_index.build(flat, description)
+                    except RuntimeError as e:
+                        logger.error(f"Could not build {description} index, serving the flat index: {e}")
+                        return vectorstore
+                    report("benchmarking_index", description=description)
+                    benchmark = ann_index.benchmark(flat, index, description, k=search_k())
+                    self.last_build = {**(self.last_build or {}), "index": benchmark}
+                    if self.store.save_ann(fingerprint, description, index):
+                        index = self.store.load_ann(fingerprint, description) or index
+
+        ann_index.apply_search_params(index)
+        logger.info(f"Serving {description} index ({index.ntotal} vectors)")
+        return FAISS(
+            embedding_function=vectorstore.embedding_function,
+            index=index,
+            docstore=vectorstore.docstore,
+            index_to_docstore_id=vectorstore.index_to_docstore_id,
+        )
+
+    def lexical_index(self, vectorstore: FAISS) -> LexicalIndex:
+        """BM25 index persisted with the vector store, built and saved if missing or stale"""
+        fingerprint = self.store.fingerprint()
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+        lexical = self.store.load_lexical(fingerprint)
+        if lexical is not None and lexical.ids == ids:
+            return lexical
+
+        lexical = LexicalIndex.from_vectorstore(vectorstore)
+        with self.store.write_lock():
+            self.store.save_lexical(fingerprint, lexical)
+        return lexical
+
+    def _plan(self, manifest: Dict[str, Any], current: Dict[str, Tuple[Path, str]]) -> Tuple[List[str], List[str]]:
+        """Sources whose content changed (or are new), and sources that disappeared"""
+        known = manifest.get("documents", {})
+        changed = sorted(source for source, (_, digest) in current.items()
+                         if known.get(source, {}).get("hash") != digest)
+        removed = sorted(source for source in known if source not in current)
+        return changed, removed
+
+    def _version(self, manifest: Dict[str, Any]) -> str:
+        """Short hash identifying the indexed corpus contents"""
+        digest = hashlib.sha256()
+        for source, entry in sorted(manifest.get("documents", {}).items()):
+            digest.update(f"{source}={entry['hash']}\n".encode())
+        return digest.hexdigest()[:12]
+
+
+# Create global corpus ingestor instance
+corpus_ingestor = CorpusIngestor()
@@ -0,0 +1,101 @@
+"""
+Background job tracking for long-running maintenance work (index rebuilds)
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class Job:
+    """A unit of background work with progress reporting"""
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = PENDING
+        self.message = ""
+        self.progress: Dict[str, Any] = {}
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def update(self, stage: str, **details: Any) -> None:
+        """Report progress from inside the running job"""
+        with self._lock:
+            self.progress = {"stage": stage, **details}
+        logger.info(f"Job {self.id} ({self.kind}): {stage} {details if details else ''}".rstrip())
+
+    @property
+    def active(self) -> bool:
+        return self.status in (PENDING, RUNNING)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "message": self.message,
+                "progress": dict(self.progress),
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """Runs jobs on daemon threads, one active job per kind"""
+
+    def __init__(self, history: int = 50):
+        self.history = history
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, target: Callable[[Job], bool]) -> Job:
+        """Start a job, or return the one of the same kind already in progress"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and job.active:
+                    return job
+
+            job = Job(kind)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+
+        thread = threading.Thread(target=self._run, args=(job, target), name=f"job-{kind}-{job.id}", daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job: Job, target: Callable[[Job], bool]) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            success = target(job)
+            job.status = SUCCEEDED if success else FAILED
+            job.message = job.message or ("Completed" if success else "Job failed")
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.status = FAILED
+            job.message = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id"""
+        return self._jobs.get(job_id)
+
+
+# Create global job manager instance
+job_manager = JobManager()
@@ -0,0 +1,138 @@
+"""
+In-process BM25 inverted index over the indexed chunks
+"""
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens; keeps terms like "5x5" and "rdl" intact"""
+    return _TOKEN.findall(text.lower())
+
+
+class LexicalIndex:
+    """BM25 over array-backed postings
+
+    Postings are stored CSR-style: the documents containing term ``t`` are
+    ``doc_ids[offsets[t]:offsets[t + 1]]``. Each posting holds its precomputed
+    BM25 weight, so a query only sums slices into a score vector.
+    """
+
+    def __init__(self, ids: List[str], terms: List[str], offsets: np.ndarray,
+                 doc_ids: np.ndarray, weights: np.ndarray):
+        self.ids = ids
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+
+    @classmethod
+    def build(cls, ids: List[str], texts: List[str],
+              k1: float = settings.BM25_K1, b: float = settings.BM25_B) -> "LexicalIndex":
+        """Build the index from chunk ids and their texts"""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        n_docs = len(texts)
+        avg_len = float(lengths.mean()) if n_docs else 0.0
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        idf = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            start, end = offsets[i], offsets[i + 1]
+            docs, counts = zip(*postings[term])
+            doc_ids[start:end] = docs
+            tfs[start:end] = counts
+            df = end - start
+            idf[start:end] = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+
+        norm = k1 * (1.0 - b + b * lengths[doc_ids] / avg_len) if avg_len else k1
+        weights = (idf * tfs * (k1 + 1.0) / (tfs + norm)).astype(np.float32)
+        return cls(list(ids), terms, offsets, doc_ids, weights)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: FAISS) -> "LexicalIndex":
+        """Index the same chunks as a FAISS store, in index order"""
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+        texts = [vectorstore.docstore.search(chunk_id).page_content for chunk_id in ids]
+        index = cls.build(ids, texts)
+        logger.info(f"Built BM25 index over {len(ids)} chunks ({len(index.terms)} terms)")
+        return index
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (position, BM25 score) pairs; positions follow the FAISS index order"""
+        term_ids = {self.terms[token] for token in tokenize(query) if token in self.terms}
+        if not term_ids or not self.ids:
+            return []
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in term_ids:
+            start, end = self.offsets[term], self.offsets[term + 1]
+            # A document appears at most once per term, so fancy += is safe
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def save(self, path: Path) -> None:
+        """Write the index as a single .npz file (no pickles)"""
+        terms = sorted(self.terms, key=self.terms.get)
+        with open(path, "wb") as file:
+            np.savez(
+                file,
+                ids=np.array(self.ids, dtype=str),
+                terms=np.array(terms, dtype=str),
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                weights=self.weights,
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        """Read an index written by save()"""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["ids"].tolist(),
+                data["terms"].tolist(),
+                data["offsets"],
+                data["doc_ids"],
+                data["weights"],
+            )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = settings.HYBRID_RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists: each list contributes 1 / (k + rank) per id"""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,306 @@
+"""
+Embedding and chat model backends selected by settings
+
+"google" uses the Gemini API. "local" uses deterministic in-process
+stand-ins so the index, caches and concurrency layers can be built,
+profiled and load-tested offline.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.core.config import settings
+from app.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+GOOGLE = "google"
+LOCAL = "local"
+
+# Gemini embeds questions and stored chunks with different task types
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+DOCUMENT_TASK_TYPE = "RETRIEVAL_DOCUMENT"
+
+_WORD = re.compile(r"[a-z0-9]+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_TOKEN = re.compile(r"\S+\s*")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i in is it me my of on or should "
+    "so than that the their this to was what when where which who why will with you your".split()
+)
+
+
+@lru_cache(maxsize=65536)
+def _feature_vector(feature: str, dim: int) -> np.ndarray:
+    """Fixed Gaussian direction for a feature, seeded by its hash"""
+    seed = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+class LocalEmbeddings(Embeddings):
+    """Random projection of hashed unigram and bigram counts, stopwords dropped
+
+    Texts sharing words get nearby unit vectors, which is enough to exercise
+    retrieval, the topic gate and the caches with realistic vector sizes.
+    ``latency_ms`` is slept once per call to model the API round trip.
+    """
+
+    def __init__(self, dim: int = 768, latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _embed(self, text: str) -> List[float]:
+        words = [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in words:
+            vector += _feature_vector(word, self.dim)
+        for first, second in zip(words, words[1:]):
+            vector += 0.5 * _feature_vector(f"{first} {second}", self.dim)
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await self.aembed_documents(texts)
+
+
+class GeminiEmbeddings(Embeddings):
+    """Gemini embeddings that always name the task type
+
+    langchain_google_genai 2.1 drops the task type ``embed_query`` resolves and
+    sends RETRIEVAL_DOCUMENT, so questions are embedded with an explicit
+    RETRIEVAL_QUERY. ``aembed_queries`` embeds many questions in batch calls.
+    """
+
+    def __init__(self, base: Embeddings):
+        self.base = base
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts, task_type=DOCUMENT_TASK_TYPE)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text, task_type=QUERY_TASK_TYPE)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.base.aembed_documents(texts, task_type=DOCUMENT_TASK_TYPE)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.base.aembed_query(text, task_type=QUERY_TASK_TYPE)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        return await self.base.aembed_documents(texts, task_type=QUERY_TASK_TYPE)
+
+
+async def aembed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Query embeddings for several questions, batched when the backend supports it"""
+    batched = getattr(embeddings, "aembed_queries", None)
+    if batched is not None:
+        return await batched(texts)
+    return list(await asyncio.gather(*(embeddings.aembed_query(text) for text in texts)))
+
+
+class LocalChatModel(BaseChatModel):
+    """Extractive stand-in for Gemini with a configurable token rate
+
+    Answers with the context sentences that share the most words with the
+    question. Time to first token is ``first_token_ms``; later tokens arrive at
+    ``tokens_per_second`` (0 = all at once).
+    """
+
+    model: str = LOCAL
+    first_token_ms: float = 0.0
+    tokens_per_second: float = 0.0
+    max_output_tokens: int = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-extractive"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = str(messages[-1].content) if messages else ""
+        context, _, question = prompt.partition("Human Question:")
+        context = context.split("Context Information:")[-1]
+        question_words = set(_WORD.findall(question.lower()))
+
+        sentences = [s.strip() for s in _SENTENCE.split(context) if len(s.strip()) > 20]
+        ranked = sorted(sentences, key=lambda s: -len(question_words & set(_WORD.findall(s.lower()))))
+        answer = " ".join(ranked[:3]) or "I don't have information about that yet."
+        return _TOKEN.findall(answer)[:self.max_output_tokens]
+
+    def _delay(self, n_tokens: int) -> float:
+        """Seconds to produce a whole answer of n tokens"""
+        rate_delay = (n_tokens - 1) / self.tokens_per_second if self.tokens_per_second and n_tokens else 0.0
+        return self.first_token_ms / 1000 + rate_delay
+
+    def _result(self, tokens: List[str]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self._delay(len(tokens)))
+        return self._result(tokens)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self._delay(len(tokens)))
+        return self._result(tokens)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_ms / 1000)
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_ms / 1000)
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class PromptCache:
+    """Gemini cached content holding the static prompt preamble as a system instruction
+
+    Requests that pass ``name`` as ``cached_content`` send only their dynamic
+    part, and the cached prefix is billed at the cached-token rate. The TTL is
+    extended in the background once half of it has passed; if the cache has
+    expired anyway, ``name`` is None and callers send the full prompt.
+    """
+
+    def __init__(self, model: str, preamble: str, ttl_seconds: float):
+        self.model = model
+        self.preamble = preamble
+        self.ttl_seconds = ttl_seconds
+        self._name: Optional[str] = None
+        self._expires_at = 0.0
+        self._refreshing = threading.Lock()
+
+    def _client(self):
+        from google import genai
+        return genai.Client(api_key=settings.GOOGLE_API_KEY)
+
+    def create(self) -> bool:
+        """Upload the preamble; False if the backend rejects it"""
+        from google.genai import types
+        try:
+            cache = self._client().caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    display_name="gympro-prompt-preamble",
+                    system_instruction=self.preamble,
+                    ttl=f"{int(self.ttl_seconds)}s"
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Could not cache the prompt preamble for {self.model}: {e}")
+            return False
+        self._name = cache.name
+        self._expires_at = time.time() + self.ttl_seconds
+        logger.info(f"Cached prompt preamble for {self.model} as {cache.name}")
+        return True
+
+    @property
+    def name(self) -> Optional[str]:
+        """Cache name to send with a request, or None to send the preamble inline"""
+        now = time.time()
+        if self._name is None or now >= self._expires_at:
+            return None
+        if now >= self._expires_at - self.ttl_seconds / 2 and self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._extend, name="prompt-cache-refresh", daemon=True).start()
+        return self._name
+
+    def _extend(self) -> None:
+        from google.genai import types
+        try:
+            self._client().caches.update(
+                name=self._name, config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl_seconds)}s")
+            )
+            self._expires_at = time.time() + self.ttl_seconds
+        except Exception as e:
+            logger.warning(f"Could not extend prompt cache {self._name}: {e}")
+        finally:
+            self._refreshing.release()
+
+
+def create_prompt_caches(preamble: str) -> Dict[str, PromptCache]:
+    """Provider-side caches of the prompt preamble, keyed by model, where the backend supports them"""
+    if not settings.PROMPT_CACHE_ENABLED or settings.LLM_PROVIDER != GOOGLE:
+        return {}
+    tokens = estimate_tokens(preamble)
+    if tokens < settings.PROMPT_CACHE_MIN_TOKENS:
+        # Explicit caches have a minimum size; Gemini still caches a repeated prefix implicitly
+        logger.info(f"Prompt preamble (~{tokens} tokens) is below the {settings.PROMPT_CACHE_MIN_TOKENS}-token "
+                    f"minimum for explicit caching; relying on implicit prefix caching")
+        return {}
+
+    caches = {}
+    for model in dict.fromkeys((settings.GOOGLE_MODEL, settings.BRIEF_MODEL)):
+        cache = PromptCache(model, preamble, settings.PROMPT_CACHE_TTL_SECONDS)
+        if cache.create():
+            caches[model] = cache
+    return caches
+
+
+def create_embeddings() -> Embeddings:
+    """Embedding backend for EMBEDDING_PROVIDER"""
+    if settings.EMBEDDING_PROVIDER == LOCAL:
+        return LocalEmbeddings(dim=settings.LOCAL_EMBEDDING_DIM, latency_ms=settings.LOCAL_EMBEDDING_LATENCY_MS)
+    if settings.EMBEDDING_PROVIDER == GOOGLE:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GeminiEmbeddings(GoogleGenerativeAIEmbeddings(
+            model=settings.EMBEDDING_MODEL,
+            google_api_key=settings.GOOGLE_API_KEY
+        ))
+    raise ValueError(f"Unknown EMBEDDING_PROVIDER {settings.EMBEDDING_PROVIDER!r}")
+
+
+def create_chat_model(model: str, max_output_tokens: Optional[int] = None) -> BaseChatModel:
+    """Chat backend for LLM_PROVIDER"""
+    if settings.LLM_PROVIDER == LOCAL:
+        return LocalChatModel(
+            first_token_ms=settings.LOCAL_LLM_FIRST_TOKEN_MS,
+            tokens_per_second=settings.LOCAL_LLM_TOKENS_PER_SECOND,
+            max_output_tokens=min(max_output_tokens or settings.LOCAL_LLM_MAX_TOKENS, settings.LOCAL_LLM_MAX_TOKENS)
+        )
+    if settings.LLM_PROVIDER == GOOGLE:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        options = {"max_output_tokens": max_output_tokens} if max_output_tokens else {}
+        return ChatGoogleGenerativeAI(
+            model=model,
+            temperature=settings.TEMPERATURE,
+            google_api_key=settings.GOOGLE_API_KEY,
+            **options
+        )
+    raise ValueError(f"Unknown LLM_PROVIDER {settings.LLM_PROVIDER!r}")
@@ -1,33 +1,147 @@
 """
 RAG (Retrieval-Augmented Generation) service for the GymPro chatbot
 """
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional, Dict, Any
+import threading
+import time
+import uuid
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
 from pathlib import Path
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
 from langchain.docstore.document import Document
-from langchain.prompts import PromptTemplate
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
 
 from app.core.config import settings
+from app.services.ingestion import corpus_files, corpus_ingestor, split_document
+from app.services.embedding_cache import (
+    CachedEmbeddings, close_cache_stores, get_cache_store, reopen_cache_stores
+)
+from app.services.answer_cache import AnswerCache, normalize_question
+from app.services.context_packer import pack_context
+from app.services.conversation import Session, is_follow_up
+from app.services.jobs import Job, job_manager
+from app.services.topic_gate import TopicGate
+from app.services.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from app.services.providers import (
+    PromptCache, aembed_queries, create_chat_model, create_embeddings, create_prompt_caches
+)
+from app.services.reranker import reranker
+from app.services.single_flight import SingleFlight
+from app.utils import metrics
+from app.utils.timing import record, stage
+from app.utils.tokens import estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# Probe used to check a freshly built index before it goes live
+SMOKE_TEST_QUERY = "proper squat form"
+
+# Answer modes chosen by the retrieval score policy
+FULL_ANSWER = "full"
+BRIEF_ANSWER = "brief"
+NO_CONTEXT = "no_context"
+
+NO_CONTEXT_RESPONSE = """I couldn't find anything about that in my knowledge base. 🤔
+
+Try asking about exercise technique, gym equipment, training programs, nutrition or injury prevention!"""
+
+BRIEF_INSTRUCTION = "(The context only partly covers this question. Answer in two or three sentences.)"
+
+CONDENSE_PROMPT = """Rewrite the user's last message as a standalone question about fitness that can be understood without the conversation. Reply with the question only.
+
+Conversation:
+{history}
+
+Last message: {question}
+
+Standalone question:"""
+
+class RAGGeneration:
+    """A fully built set of RAG components that is swapped in as one unit"""
+    
+    def __init__(self, embeddings: Embeddings, vectorstore: FAISS,
+                 llm: BaseChatModel, corpus_version: str,
+                 topic_gate: Optional[TopicGate] = None,
+                 brief_llm: Optional[BaseChatModel] = None,
+                 lexical_index: Optional[LexicalIndex] = None,
+                 prompt_caches: Optional[Dict[str, PromptCache]] = None):
+        self.id = uuid.uuid4().hex[:8]
+        self.embeddings = embeddings
+        self.vectorstore = vectorstore
+        self.llm = llm
+        self.brief_llm = brief_llm or llm
+        self.lexical_index = lexical_index
+        self.corpus_version = corpus_version
+        self.topic_gate = topic_gate
+        self.prompt_caches = prompt_caches or {}
+        self.built_at = time.time()
+        self._positions: Optional[Dict[str, int]] = None
+    
+    def cached_prefix(self, brief: bool = False) -> Optional[str]:
+        """Provider cache holding the prompt preamble for the model that will answer, if live"""
+        cache = self.prompt_caches.get(settings.BRIEF_MODEL if brief else settings.GOOGLE_MODEL)
+        return cache.name if cache else None
+    
+    def stored_vectors(self, documents: List[Document]) -> Optional[np.ndarray]:
+        """Indexed embeddings of retrieved chunks, or None if the index can't reconstruct them"""
+        if self._positions is None:
+            self._positions = {chunk_id: position for position, chunk_id in self.vectorstore.index_to_docstore_id.items()}
+        try:
+            positions = np.asarray([self._positions[doc.metadata["chunk_id"]] for doc in documents], dtype=np.int64)
+            return self.vectorstore.index.reconstruct_batch(positions)
+        except (KeyError, RuntimeError):
+            return None
+
 class RAGService:
     """Service class for handling RAG operations"""
     
     def __init__(self):
-        self.vectorstore: Optional[FAISS] = None
-        self.qa_chain: Optional[RetrievalQA] = None
-        self.embeddings: Optional[GoogleGenerativeAIEmbeddings] = None
-        self.prompt_template = self._create_prompt_template()
-    
-    def _create_prompt_template(self) -> PromptTemplate:
-        """Create the RAG prompt template"""
-        template = """You are GymPro AI, an expert fitness and gym assistant with comprehensive knowledge about:
+        # Queries read this once and keep using it, so a swap never affects
+        # requests that are already in flight
+        self._generation: Optional[RAGGeneration] = None
+        self._swap_lock = threading.Lock()
+        # Only one build (startup, supervisor retry or reset) runs at a time
+        self._build_lock = threading.Lock()
+        self._building = False
+        self._build_attempts = 0
+        self._last_build_error: Optional[str] = None
+        self._last_build_at: Optional[float] = None
+        self._next_retry_at: Optional[float] = None
+        self._status: Dict[str, Any] = {}
+        self.answer_cache: Optional[AnswerCache] = None
+        if settings.ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+                ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+                similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+            )
+        self.prompt_preamble = self._create_prompt_preamble()
+        self._query_semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Identical questions in flight at the same time share one answer
+        self._flights = SingleFlight()
+        self._refresh_status()
+    
+    @property
+    def vectorstore(self) -> Optional[FAISS]:
+        return self._generation.vectorstore if self._generation else None
+    
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._generation.embeddings if self._generation else None
+    
+    @property
+    def llm(self) -> Optional[BaseChatModel]:
+        return self._generation.llm if self._generation else None
+    
+    def _create_prompt_preamble(self) -> str:
+        """Static part of the RAG prompt, built once; only context and question vary per request"""
+        return """You are GymPro AI, an expert fitness and gym assistant with comprehensive knowledge about:
 - Exercise techniques and proper form
 - Workout routines and training programs  
 - Gym equipment usage and safety
@@ -45,37 +159,17 @@ IMPORTANT GUIDELINES:
 7. Be encouraging and supportive in your responses
 8. If you're uncertain about something, say so rather than guessing
 
-Context Information:
-{context}
-
-Human Question: {question}
-
-GymPro AI Response:"""
-        
-        return PromptTemplate(
-            template=template,
-            input_variables=["context", "question"]
-        )
+"""
     
     def load_gym_data(self) -> List[Document]:
-        """Load gym data from file and split into documents"""
+        """Load every corpus file under DATA_DIR and split into documents"""
         try:
-            if not settings.GYM_DATA_FILE.exists():
-                logger.error(f"Gym data file not found: {settings.GYM_DATA_FILE}")
-                return []
-            
-            with open(settings.GYM_DATA_FILE, 'r', encoding='utf-8') as file:
-                content = file.read()
-            
-            # Split content into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=settings.CHUNK_SIZE,
-                chunk_overlap=settings.CHUNK_OVERLAP,
-                length_function=len,
-            )
+            documents = []
+            for path in corpus_files():
+                documents.extend(split_document(path))
             
-            chunks = text_splitter.split_text(content)
-            documents = [Document(page_content=chunk) for chunk in chunks]
+            if not documents:
+                logger.error(f"No gym data files found in: {settings.DATA_DIR}")
             
             logger.info(f"Loaded {len(documents)} document chunks from gym data")
             return documents
@@ -86,110 +180,830 @@ GymPro AI Response:"""
     
     def initialize_rag_system(self) -> bool:
         """Initialize the RAG system with FAISS vector store"""
+        return self._build_and_swap() is not None
+    
+    def ensure_ready(self) -> bool:
+        """Build the RAG system unless it is already serving; waits for a build in progress"""
+        with self._build_lock:
+            if self._generation is not None:
+                return True
+            return self._build_and_swap(locked=True) is not None
+    
+    def _build_and_swap(self, job: Optional[Job] = None, locked: bool = False) -> Optional[RAGGeneration]:
+        """Build a generation under the build lock and make it live if it passes"""
+        if not locked:
+            with self._build_lock:
+                return self._build_and_swap(job, locked=True)
+        
+        self._building = True
+        self._build_attempts += 1
+        self._refresh_status()
+        try:
+            generation = self.build_generation(job)
+            if generation is not None:
+                if job:
+                    job.update("swapping", generation=generation.id)
+                self._swap(generation)
+                self._last_build_error = None
+            return generation
+        finally:
+            self._building = False
+            self._last_build_at = time.time()
+            self._refresh_status()
+    
+    def build_generation(self, job: Optional[Job] = None) -> Optional[RAGGeneration]:
+        """Build and smoke-test a new set of RAG components without touching the live one"""
+        def report(stage: str, **details: Any) -> None:
+            if job:
+                job.update(stage, **details)
+        
         try:
             # Validate settings
             if not settings.validate_settings():
-                logger.error("Invalid settings configuration")
-                return False
-            
-            # Load gym data
-            documents = self.load_gym_data()
-            if not documents:
-                logger.error("No documents loaded")
-                return False
+                return self._build_failed("Invalid settings configuration")
             
             # Initialize embeddings
-            self.embeddings = GoogleGenerativeAIEmbeddings(
-                model=settings.EMBEDDING_MODEL,
-                google_api_key=settings.GOOGLE_API_KEY
-            )
+            report("initializing_embeddings")
+            embeddings = self._create_embeddings()
             
-            # Create FAISS vector store
-            logger.info("Creating FAISS vector store...")
-            self.vectorstore = FAISS.from_documents(documents, self.embeddings)
+            # Apply corpus changes to the persisted index, embedding only new chunks
+            report("syncing_index")
+            vectorstore, corpus_version = corpus_ingestor.sync(embeddings, report)
+            if vectorstore is None:
+                return self._build_failed("No documents could be indexed")
             
-            # Initialize the LLM
-            llm = ChatGoogleGenerativeAI(
-                model=settings.GOOGLE_MODEL,
-                temperature=settings.TEMPERATURE,
-                google_api_key=settings.GOOGLE_API_KEY
-            )
+            # Swap in the configured ANN index (HNSW / IVF-PQ) for serving
+            vectorstore = corpus_ingestor.serving_index(vectorstore, report)
+            
+            # BM25 index over the same chunks, loaded from next to the FAISS index
+            lexical_index = None
+            if settings.HYBRID_RETRIEVAL:
+                report("loading_lexical_index")
+                lexical_index = corpus_ingestor.lexical_index(vectorstore)
+            
+            # Initialize the LLM, plus a shorter, cheaper one for weakly matching context
+            llm, brief_llm = self._create_llms()
             
-            # Create the retrieval QA chain with custom prompt
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=self.vectorstore.as_retriever(
-                    search_type="similarity",
-                    search_kwargs={"k": settings.SIMILARITY_SEARCH_K}
-                ),
-                return_source_documents=True,
-                chain_type_kwargs={"prompt": self.prompt_template}
+            if reranker.enabled:
+                report("loading_reranker")
+                reranker.load()
+            
+            # Gemini can hold the static preamble server-side so it isn't re-sent and re-billed
+            prompt_caches = {}
+            if settings.PROMPT_CACHE_ENABLED:
+                report("caching_prompt_prefix")
+                prompt_caches = create_prompt_caches(self.prompt_preamble)
+            
+            # Topic centroids for the embedding gate come from the indexed corpus
+            topic_gate = None
+            if settings.TOPIC_GATE_MODE == "embedding":
+                report("building_topic_gate")
+                topic_gate = TopicGate.from_vectorstore(
+                    vectorstore,
+                    n_centroids=settings.TOPIC_GATE_CENTROIDS,
+                    threshold=settings.TOPIC_GATE_THRESHOLD
+                )
+            
+            generation = RAGGeneration(
+                embeddings, vectorstore, llm, corpus_version,
+                topic_gate=topic_gate, brief_llm=brief_llm, lexical_index=lexical_index,
+                prompt_caches=prompt_caches
             )
             
-            logger.info("RAG system initialized successfully with FAISS")
-            return True
+            report("smoke_test")
+            if not self._smoke_test(generation):
+                return self._build_failed("New RAG generation failed its smoke test")
+            
+            return generation
             
         except Exception as e:
-            logger.error(f"Error initializing RAG system: {e}")
-            return False
+            return self._build_failed(f"Error initializing RAG system: {e}")
+    
+    def _create_embeddings(self) -> Embeddings:
+        """Embedding client, served from the on-disk cache for repeated chunks and questions"""
+        embeddings = create_embeddings()
+        if settings.EMBEDDING_CACHE_ENABLED:
+            embeddings = CachedEmbeddings(
+                embeddings,
+                model_name=settings.embedding_model_name,
+                store=get_cache_store()
+            )
+        return embeddings
+    
+    def _create_llms(self) -> Tuple[BaseChatModel, BaseChatModel]:
+        """Main and brief-answer chat clients"""
+        return (
+            create_chat_model(settings.GOOGLE_MODEL),
+            create_chat_model(settings.BRIEF_MODEL, max_output_tokens=settings.BRIEF_MAX_OUTPUT_TOKENS)
+        )
+    
+    def prepare_fork(self) -> None:
+        """Release per-process resources before a server master forks workers"""
+        close_cache_stores()
+    
+    def after_fork(self) -> None:
+        """Give a freshly forked worker its own caches and API clients
+        
+        The index, docstore and BM25 arrays stay shared with the master
+        copy-on-write; gRPC channels and cache file locks do not survive fork.
+        """
+        reopen_cache_stores()
+        generation = self._generation
+        if generation is not None:
+            embeddings = self._create_embeddings()
+            generation.embeddings = embeddings
+            generation.vectorstore.embedding_function = embeddings
+            generation.llm, generation.brief_llm = self._create_llms()
+    
+    def _build_failed(self, error: str) -> None:
+        """Log and remember why a build failed, for the health snapshot"""
+        logger.error(error)
+        self._last_build_error = error
+        return None
+    
+    def _smoke_test(self, generation: RAGGeneration) -> bool:
+        """Check that a freshly built generation can embed and retrieve"""
+        documents = generation.vectorstore.similarity_search(SMOKE_TEST_QUERY, k=1)
+        return len(documents) > 0
+    
+    def _swap(self, generation: RAGGeneration) -> None:
+        """Atomically make a generation live"""
+        with self._swap_lock:
+            previous = self._generation
+            self._generation = generation
+            # Answers cached against a previous index may no longer hold
+            if self.answer_cache:
+                self.answer_cache.clear()
+        
+        if previous is not None and isinstance(previous.embeddings, CachedEmbeddings):
+            previous.embeddings.store.flush()
+        logger.info(f"RAG system initialized successfully with FAISS (generation {generation.id})")
     
     def query(self, message: str) -> Dict[str, Any]:
-        """Query the RAG system"""
+        """Query the RAG system (synchronous wrapper around aquery for scripts)"""
+        try:
+            return asyncio.run(self.aquery(message))
+        except Exception as e:
+            logger.error(f"Error querying RAG system: {e}")
+            return self._error_result(str(e))
+    
+    async def aclassify(self, message: str) -> Optional[Dict[str, Any]]:
+        """Score a message against the corpus topic centroids
+        
+        Returns the verdict, the score and the query embedding (to be passed on
+        to aquery/astream_query), or None when the embedding gate is unavailable.
+        """
+        generation = self._generation
+        if generation is None or generation.topic_gate is None:
+            return None
+        try:
+            with stage("embed"):
+                vector = await generation.embeddings.aembed_query(message)
+        except Exception as e:
+            logger.warning(f"Topic gate could not embed the query: {e}")
+            return None
+        score = generation.topic_gate.score(vector)
+        logger.debug(f"Topic gate score {score:.3f} for query")
+        return {
+            "gym_related": score >= generation.topic_gate.threshold,
+            "score": score,
+            "vector": vector
+        }
+    
+    def _cache_for(self, history: str) -> Optional[AnswerCache]:
+        """Answer cache to use, or None when the answer depends on session history"""
+        return None if history else self.answer_cache
+    
+    async def aquery(self, message: str, query_vector: Optional[List[float]] = None,
+                     history: str = "") -> Dict[str, Any]:
+        """Query the RAG system without blocking the event loop"""
         try:
-            if not self.qa_chain:
+            generation = self._generation
+            if generation is None:
                 raise ValueError("RAG system not initialized")
             
-            result = self.qa_chain({"query": message})
+            cache = self._cache_for(history)
+            cached = cache.get_exact(message) if cache else None
+            if cached:
+                return cached
             
-            # Extract sources if available
-            sources = []
-            if "source_documents" in result and result["source_documents"]:
-                sources = [doc.page_content[:100] + "..." for doc in result["source_documents"]]
+            # The timeout covers both waiting for a slot and the pipeline itself
+            def work():
+                return asyncio.wait_for(
+                    self._run_limited(lambda: self._answer(generation, message, query_vector, history)),
+                    timeout=settings.QUERY_TIMEOUT_SECONDS
+                )
             
-            return {
-                "response": result["result"],
-                "sources": sources,
-                "success": True
-            }
+            if not settings.COALESCE_REQUESTS:
+                return await work()
+            return await self._flights.run(self._flight_key(message, history), work)
             
+        except asyncio.TimeoutError:
+            logger.error(f"RAG query timed out after {settings.QUERY_TIMEOUT_SECONDS}s")
+            return self._error_result("Query timed out")
         except Exception as e:
             logger.error(f"Error querying RAG system: {e}")
-            return {
-                "response": "",
-                "sources": [],
-                "success": False,
-                "error": str(e)
-            }
+            return self._error_result(str(e))
     
-    def reset_system(self) -> bool:
-        """Reset and reinitialize the RAG system"""
+    async def _answer(self, generation: RAGGeneration, message: str,
+                      vector: Optional[List[float]] = None, history: str = "") -> Dict[str, Any]:
+        """Embed, check the semantic cache, retrieve and generate"""
+        cache = self._cache_for(history)
+        epoch = cache.epoch if cache else None
+        if vector is None:
+            with stage("embed"):
+                vector = await generation.embeddings.aembed_query(message)
+        
+        cached = cache.get_similar(vector) if cache else None
+        if cached:
+            return cached
+        
+        scored = await self._retrieve(generation, vector, message)
+        return await self._generate(generation, message, vector, scored, epoch, history)
+    
+    async def _generate(self, generation: RAGGeneration, message: str, vector: List[float],
+                        scored: List[Tuple[Document, float]], epoch: Optional[int],
+                        history: str = "") -> Dict[str, Any]:
+        """Apply the score policy to retrieved chunks, generate and cache the answer"""
+        mode, documents, scores = self._answer_plan(scored)
+        if mode == NO_CONTEXT:
+            metrics.fallbacks.inc(reason="no_context")
+            result = self._format_result(NO_CONTEXT_RESPONSE, [], [], mode)
+        else:
+            llm = generation.brief_llm if mode == BRIEF_ANSWER else generation.llm
+            cached_prefix = generation.cached_prefix(brief=mode == BRIEF_ANSWER)
+            with stage("prompt"):
+                prompt = self._render_prompt(documents, message, brief=mode == BRIEF_ANSWER, history=history,
+                                             preamble=cached_prefix is None)
+            with stage("llm"):
+                answer = await llm.ainvoke(prompt, **self._llm_options(cached_prefix))
+            self._record_usage(answer)
+            result = self._format_result(answer.content, documents, scores, mode)
+        
+        cache = self._cache_for(history)
+        if cache:
+            cache.put(message, vector, result, epoch=epoch)
+        return result
+    
+    async def abatch_query(self, messages: List[str], keyword_related: List[bool]) -> AsyncIterator[Dict[str, Any]]:
+        """Answer many questions, yielding ``{"index", "result", "cached", "timings"}`` as each finishes
+        
+        Uncached questions share one embedding call and one vector index search;
+        LLM calls then fan out under BATCH_CONCURRENCY (and the global query
+        limit). Off-topic items are yielded with ``result`` None.
+        """
+        start = time.perf_counter()
+        generation = self._generation
+        if generation is None:
+            raise ValueError("RAG system not initialized")
+        
+        def elapsed_ms(since: float) -> float:
+            return round((time.perf_counter() - since) * 1000, 1)
+        
+        def item(index: int, result: Optional[Dict[str, Any]], cached: bool = False, **timings) -> Dict[str, Any]:
+            return {"index": index, "result": result, "cached": cached,
+                    "timings": {**timings, "total_ms": elapsed_ms(start)}}
+        
+        # With the embedding gate, keyword verdicts are replaced by centroid scores
+        gate = generation.topic_gate if settings.TOPIC_GATE_MODE == "embedding" else None
+        epoch = self.answer_cache.epoch if self.answer_cache else None
+        pending = []
+        for index, message in enumerate(messages):
+            if gate is None and not keyword_related[index]:
+                yield item(index, None)
+                continue
+            cached = self.answer_cache.get_exact(message) if self.answer_cache else None
+            if cached:
+                yield item(index, cached, cached=True)
+            else:
+                pending.append(index)
+        if not pending:
+            return
+        
+        # Questions need the query task type the single-query path uses, not the
+        # document type of aembed_documents; aembed_queries batches them with it
+        embed_start = time.perf_counter()
+        try:
+            with stage("batch_embed"):
+                vectors = await asyncio.wait_for(
+                    aembed_queries(generation.embeddings, [messages[i] for i in pending]),
+                    timeout=settings.QUERY_TIMEOUT_SECONDS
+                )
+        except Exception as e:
+            logger.error(f"Batch embedding failed: {e}")
+            for index in pending:
+                yield item(index, self._error_result(f"Embedding failed: {e}"))
+            return
+        embed_ms = elapsed_ms(embed_start)
+        
+        to_answer = []
+        for index, vector in zip(pending, vectors):
+            if gate is not None and not gate.is_on_topic(vector):
+                yield item(index, None, embed_ms=embed_ms)
+                continue
+            cached = self.answer_cache.get_similar(vector) if self.answer_cache else None
+            if cached:
+                yield item(index, cached, cached=True, embed_ms=embed_ms)
+            else:
+                to_answer.append((index, vector))
+        if not to_answer:
+            return
+        
+        search_start = time.perf_counter()
+        with stage("batch_search"):
+            scored_lists = await asyncio.to_thread(
+                self._search, generation, [vector for _, vector in to_answer], [messages[i] for i, _ in to_answer],
+                self._candidate_limit()
+            )
+        search_ms = elapsed_ms(search_start)
+        
+        batch_slots = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+        
+        async def answer(index: int, vector: List[float], scored: List[Tuple[Document, float]]):
+            async with batch_slots:
+                scored = await self._rerank(generation, vector, messages[index], scored)
+                llm_start = time.perf_counter()
+                try:
+                    result = await asyncio.wait_for(
+                        self._run_limited(lambda: self._generate(generation, messages[index], vector, scored, epoch)),
+                        timeout=settings.QUERY_TIMEOUT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    result = self._error_result("Query timed out")
+                except Exception as e:
+                    logger.error(f"Batch item {index} failed: {e}")
+                    result = self._error_result(str(e))
+                return item(index, result, embed_ms=embed_ms, search_ms=search_ms, llm_ms=elapsed_ms(llm_start))
+        
+        tasks = [asyncio.create_task(answer(index, vector, scored))
+                 for (index, vector), scored in zip(to_answer, scored_lists)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The client may stop reading; don't keep spending LLM calls for it
+            for task in tasks:
+                task.cancel()
+    
+    @staticmethod
+    def _flight_key(message: str, history: str) -> str:
+        """Coalescing key: the normalized question, plus the session history it is answered with"""
+        key = normalize_question(message)
+        if history:
+            key += "\0" + hashlib.sha1(history.encode("utf-8")).hexdigest()
+        return key
+    
+    async def astream_query(self, message: str, query_vector: Optional[List[float]] = None,
+                            history: str = "") -> AsyncIterator[Dict[str, Any]]:
+        """Stream a RAG answer as events: sources first, then tokens, then done
+        
+        Concurrent identical questions share one stream; later joiners replay
+        the events sent so far, then follow it live.
+        """
+        if not settings.COALESCE_REQUESTS:
+            events = self._stream_answer(message, query_vector, history)
+        else:
+            events = self._flights.stream(
+                self._flight_key(message, history), lambda: self._stream_answer(message, query_vector, history)
+            )
+        async for event in events:
+            yield event
+    
+    async def _stream_answer(self, message: str, query_vector: Optional[List[float]],
+                             history: str) -> AsyncIterator[Dict[str, Any]]:
+        """Answer events for one streamed question"""
+        start = time.perf_counter()
+        deadline = start + settings.QUERY_TIMEOUT_SECONDS
+        
+        def remaining() -> float:
+            return max(deadline - time.perf_counter(), 0)
+        
+        generation = self._generation
+        if generation is None:
+            yield {"event": "error", "data": {"error": "RAG system not initialized"}}
+            return
+        
         try:
-            # Clear existing components
-            self.vectorstore = None
-            self.qa_chain = None
-            self.embeddings = None
+            cache = self._cache_for(history)
+            epoch = cache.epoch if cache else None
+            cached = cache.get_exact(message) if cache else None
             
-            # Reinitialize
-            return self.initialize_rag_system()
+            async with self._get_semaphore():
+                vector = query_vector
+                if cached is None and vector is None:
+                    with stage("embed"):
+                        vector = await asyncio.wait_for(
+                            generation.embeddings.aembed_query(message), timeout=remaining()
+                        )
+                if cached is None:
+                    cached = cache.get_similar(vector) if cache else None
+                
+                if cached:
+                    yield {"event": "sources", "data": {
+                        "sources": cached["sources"],
+                        "source_details": cached.get("source_details", []),
+                        "scores": cached.get("scores", [])
+                    }}
+                    yield {"event": "token", "data": {"text": cached["response"]}}
+                    yield self._done_event(start, cached=True, answer_mode=cached.get("answer_mode"))
+                    return
+                
+                scored = await asyncio.wait_for(self._retrieve(generation, vector, message), timeout=remaining())
+                mode, documents, scores = self._answer_plan(scored)
+                retrieval_ms = (time.perf_counter() - start) * 1000
+                yield {"event": "sources", "data": {
+                    "sources": self._format_sources(documents),
+                    "source_details": self._format_source_details(documents, scores),
+                    "scores": scores
+                }}
+                
+                if mode == NO_CONTEXT:
+                    metrics.fallbacks.inc(reason="no_context")
+                    result = self._format_result(NO_CONTEXT_RESPONSE, [], [], mode)
+                    if cache:
+                        cache.put(message, vector, result, epoch=epoch)
+                    yield {"event": "token", "data": {"text": NO_CONTEXT_RESPONSE}}
+                    yield self._done_event(start, answer_mode=mode, retrieval_ms=round(retrieval_ms, 1))
+                    return
+                
+                first_token_ms = None
+                parts = []
+                llm = generation.brief_llm if mode == BRIEF_ANSWER else generation.llm
+                cached_prefix = generation.cached_prefix(brief=mode == BRIEF_ANSWER)
+                with stage("prompt"):
+                    prompt = self._render_prompt(documents, message, brief=mode == BRIEF_ANSWER, history=history,
+                                                 preamble=cached_prefix is None)
+                llm_start = time.perf_counter()
+                stream = llm.astream(prompt, **self._llm_options(cached_prefix)).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=remaining())
+                    except StopAsyncIteration:
+                        break
+                    self._record_usage(chunk)
+                    if not chunk.content:
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                        record("llm_first_token", time.perf_counter() - llm_start)
+                    parts.append(chunk.content)
+                    yield {"event": "token", "data": {"text": chunk.content}}
+                record("llm", time.perf_counter() - llm_start)
             
+            if cache:
+                cache.put(
+                    message, vector, self._format_result("".join(parts), documents, scores, mode), epoch=epoch
+                )
+            
+            yield self._done_event(
+                start,
+                answer_mode=mode,
+                retrieval_ms=round(retrieval_ms, 1),
+                first_token_ms=round(first_token_ms, 1) if first_token_ms else None
+            )
+            
+        except asyncio.TimeoutError:
+            logger.error(f"RAG stream timed out after {settings.QUERY_TIMEOUT_SECONDS}s")
+            yield {"event": "error", "data": {"error": "Query timed out"}}
+        except Exception as e:
+            logger.error(f"Error streaming RAG response: {e}")
+            yield {"event": "error", "data": {"error": str(e)}}
+    
+    async def acondense(self, message: str, session: Optional[Session]) -> str:
+        """Standalone retrieval query for a message in a session (QUERY_CONDENSE_MODE)
+
+        Follow-ups get the session topic prepended; in "llm" mode the brief model
+        rewrites them instead, falling back to the heuristic on error or timeout.
+        """
+        if session is None or settings.QUERY_CONDENSE_MODE == "off" or not is_follow_up(message):
+            return message
+        heuristic = session.condense(message)
+        generation = self._generation
+        if settings.QUERY_CONDENSE_MODE != "llm" or generation is None or not session.turns:
+            return heuristic
+        
+        try:
+            with stage("condense"):
+                answer = await asyncio.wait_for(
+                    generation.brief_llm.ainvoke(CONDENSE_PROMPT.format(history=session.history(), question=message)),
+                    timeout=settings.QUERY_CONDENSE_TIMEOUT_SECONDS
+                )
+            standalone = str(answer.content).strip()
+            return standalone.splitlines()[0] if standalone else heuristic
         except Exception as e:
-            logger.error(f"Error resetting RAG system: {e}")
+            logger.warning(f"Query condensation failed, using the session topic: {e}")
+            return heuristic
+    
+    def _done_event(self, start: float, cached: bool = False, answer_mode: Optional[str] = None,
+                    **timings) -> Dict[str, Any]:
+        """Final stream event with timing metadata"""
+        timings["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return {"event": "done", "data": {"cached": cached, "answer_mode": answer_mode, "timings": timings}}
+    
+    async def _retrieve(self, generation: RAGGeneration, vector: List[float],
+                        message: str) -> List[Tuple[Document, float]]:
+        """Top-k chunks for a query with their relevance scores, re-ranked if enabled"""
+        with stage("search"):
+            results = await asyncio.to_thread(self._search, generation, [vector], [message], self._candidate_limit())
+        return await self._rerank(generation, vector, message, results[0])
+    
+    @staticmethod
+    def _candidate_limit() -> int:
+        """Chunks to retrieve: a wider pool when a re-ranker will choose among them"""
+        return max(settings.RERANK_CANDIDATES, settings.SIMILARITY_SEARCH_K) if reranker.enabled else settings.SIMILARITY_SEARCH_K
+    
+    async def _rerank(self, generation: RAGGeneration, vector: List[float], message: str,
+                      scored: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        """Re-rank candidates within RERANK_BUDGET_MS, keeping retrieval order if it fails or runs over"""
+        k = settings.SIMILARITY_SEARCH_K
+        if not reranker.enabled or len(scored) <= 1:
+            return scored[:k]
+        
+        def run() -> List[Tuple[Document, float]]:
+            vectors = generation.stored_vectors([doc for doc, _ in scored]) if reranker.uses_mmr else None
+            return reranker.rerank(message, vector, scored, vectors, k)
+        
+        try:
+            with stage("rerank"):
+                # A cross-encoder batch can't be interrupted; past the budget its result is just ignored
+                return await asyncio.wait_for(asyncio.to_thread(run), timeout=settings.RERANK_BUDGET_MS / 1000)
+        except asyncio.TimeoutError:
+            metrics.rerank_skipped.inc(reason="timeout")
+        except Exception as e:
+            logger.warning(f"Re-ranking failed, using retrieval order: {e}")
+            metrics.rerank_skipped.inc(reason="error")
+        return scored[:k]
+    
+    def _search(self, generation: RAGGeneration, vectors: List[List[float]], messages: List[str],
+                limit: Optional[int] = None) -> List[List[Tuple[Document, float]]]:
+        """Top-k chunks with relevance scores for several queries in one vector index search
+        
+        With a BM25 index, dense and lexical candidates are fused by reciprocal
+        rank so exact terms ("5x5", "RDL") surface even when embeddings miss them.
+        """
+        store = generation.vectorstore
+        lexical = generation.lexical_index
+        limit = limit or settings.SIMILARITY_SEARCH_K
+        k = max(settings.HYBRID_CANDIDATES, limit) if lexical is not None else limit
+        distances, positions = store.index.search(np.asarray(vectors, dtype=np.float32), k)
+        
+        results = []
+        for vector, message, row_distances, row_positions in zip(vectors, messages, distances, positions):
+            candidates: Dict[str, Tuple[Document, float]] = {}
+            for distance, position in zip(row_distances, row_positions):
+                if position < 0:
+                    continue
+                chunk_id = store.index_to_docstore_id[int(position)]
+                doc = store.docstore.search(chunk_id)
+                if isinstance(doc, Document):
+                    candidates[chunk_id] = (doc, self._relevance(distance))
+            
+            if lexical is None:
+                results.append(list(candidates.values()))
+            else:
+                results.append(self._fuse(generation, candidates, lexical.search(message, k), vector, limit))
+        return results
+    
+    def _fuse(self, generation: RAGGeneration, candidates: Dict[str, Tuple[Document, float]],
+              lexical_hits: List[Tuple[int, float]], vector: List[float], limit: int) -> List[Tuple[Document, float]]:
+        """Reciprocal rank fusion of dense candidates and BM25 hits, cut to limit"""
+        lexical = generation.lexical_index
+        positions = {lexical.ids[position]: position for position, _ in lexical_hits}
+        
+        results = []
+        for chunk_id, _ in reciprocal_rank_fusion([list(candidates), list(positions)]):
+            if len(results) >= limit:
+                break
+            if chunk_id in candidates:
+                results.append(candidates[chunk_id])
+                continue
+            doc = generation.vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                results.append((doc, self._vector_relevance(generation, positions[chunk_id], vector)))
+        return results
+    
+    def _vector_relevance(self, generation: RAGGeneration, position: int, vector: List[float]) -> float:
+        """Cosine relevance of a lexical-only hit, from its stored vector"""
+        try:
+            stored = generation.vectorstore.index.reconstruct(position)
+        except RuntimeError:
+            # Index type cannot reconstruct: a BM25 match counts as just relevant
+            return settings.RETRIEVAL_MIN_SCORE
+        query = np.asarray(vector, dtype=np.float32)
+        norms = float(np.linalg.norm(stored) * np.linalg.norm(query))
+        return round(float(stored @ query) / norms, 4) if norms else 0.0
+    
+    @staticmethod
+    def _relevance(distance: float) -> float:
+        """Cosine similarity from a FAISS squared L2 distance between unit-length embeddings"""
+        return round(1.0 - float(distance) / 2.0, 4)
+    
+    def _answer_plan(self, scored: List[Tuple[Document, float]]) -> Tuple[str, List[Document], List[float]]:
+        """Apply the score policy, then pack the relevant chunks into the mode's context token budget"""
+        relevant = [(doc, score) for doc, score in scored if score >= settings.RETRIEVAL_MIN_SCORE]
+        if not relevant:
+            best = max((score for _, score in scored), default=None)
+            logger.info(f"No chunk cleared the relevance threshold (best score {best}); skipping the LLM")
+            return NO_CONTEXT, [], []
+        
+        mode = FULL_ANSWER if max(score for _, score in relevant) >= settings.RETRIEVAL_BRIEF_SCORE else BRIEF_ANSWER
+        budget = settings.CONTEXT_TOKEN_BUDGET if mode == FULL_ANSWER else settings.CONTEXT_BRIEF_TOKEN_BUDGET
+        packed = pack_context(relevant, budget, settings.CONTEXT_MIN_PASSAGE_TOKENS)
+        metrics.context_tokens.observe(sum(estimate_tokens(doc.page_content) for doc, _ in packed), mode=mode)
+        return mode, [doc for doc, _ in packed], [score for _, score in packed]
+    
+    def _render_prompt(self, documents: List[Document], question: str, brief: bool = False,
+                       history: str = "", preamble: bool = True) -> str:
+        """Assemble the prompt from the precomputed preamble, session history, packed context and question
+        
+        With ``preamble=False`` the preamble is left out because the provider
+        already holds it as cached content.
+        """
+        if brief:
+            question = f"{question}\n{BRIEF_INSTRUCTION}"
+        parts = [self.prompt_preamble] if preamble else []
+        if history:
+            parts += ["Conversation So Far:\n", history, "\n\n"]
+        parts += [
+            "Context Information:\n", "\n\n".join(doc.page_content for doc in documents),
+            "\n\nHuman Question: ", question, "\n\nGymPro AI Response:"
+        ]
+        return "".join(parts)
+    
+    @staticmethod
+    def _llm_options(cached_prefix: Optional[str]) -> Dict[str, Any]:
+        """Per-call LLM arguments: the provider cache holding the preamble, if any"""
+        return {"cached_content": cached_prefix} if cached_prefix else {}
+    
+    @staticmethod
+    def _record_usage(message: Any) -> None:
+        """Count prompt tokens the provider read from its cache versus billed in full"""
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+        metrics.llm_input_tokens.inc(cached, cache="hit")
+        metrics.llm_input_tokens.inc(usage.get("input_tokens", 0) - cached, cache="miss")
+    
+    async def _run_limited(self, factory):
+        """Run a coroutine factory under the per-worker concurrency limit"""
+        async with self._get_semaphore():
+            return await factory()
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Get the query semaphore bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._query_semaphore is None or self._semaphore_loop is not loop:
+            self._query_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_QUERIES)
+            self._semaphore_loop = loop
+        return self._query_semaphore
+    
+    def _format_result(self, response: str, documents: List[Document], scores: Optional[List[float]] = None,
+                       answer_mode: str = FULL_ANSWER) -> Dict[str, Any]:
+        """Shape a generated answer into the service response"""
+        return {
+            "response": response,
+            "sources": self._format_sources(documents),
+            "source_details": self._format_source_details(documents, scores),
+            "scores": list(scores or []),
+            "answer_mode": answer_mode,
+            "success": True
+        }
+    
+    def _format_sources(self, documents: List[Document]) -> List[str]:
+        """Short previews of the documents used for an answer"""
+        return [doc.page_content[:100] + "..." for doc in documents]
+    
+    def _format_source_details(self, documents: List[Document],
+                               scores: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Where each document used for an answer came from"""
+        scores = scores or [None] * len(documents)
+        return [
+            {
+                "source": doc.metadata.get("source"),
+                "section": doc.metadata.get("section"),
+                "offset": doc.metadata.get("offset"),
+                "preview": doc.page_content[:100] + "...",
+                "score": score
+            }
+            for doc, score in zip(documents, scores)
+        ]
+    
+    def _error_result(self, error: str) -> Dict[str, Any]:
+        """Build a failed query response"""
+        return {
+            "response": "",
+            "sources": [],
+            "source_details": [],
+            "scores": [],
+            "answer_mode": None,
+            "success": False,
+            "error": error
+        }
+    
+    def reset_system(self) -> bool:
+        """Rebuild the RAG system and swap it in; the old generation serves until then"""
+        return self.initialize_rag_system()
+    
+    def start_reset(self) -> Job:
+        """Rebuild in the background and swap atomically once the new generation is ready"""
+        return job_manager.submit("reset", self._reset_job)
+    
+    def _reset_job(self, job: Job) -> bool:
+        generation = self._build_and_swap(job)
+        if generation is None:
+            job.message = "Rebuild failed; the previous generation is still serving"
             return False
+        job.message = f"Generation {generation.id} is live"
+        return True
+    
+    def schedule_retry(self, delay: Optional[float]) -> None:
+        """Record when the supervisor will next try to build (None: no retry pending)"""
+        self._next_retry_at = time.time() + delay if delay is not None else None
+        self._refresh_status()
+    
+    def _refresh_status(self) -> None:
+        """Rebuild the health snapshot; called whenever the build state changes"""
+        generation = self._generation
+        if generation is not None:
+            state = "ready"
+        elif self._building:
+            state = "building"
+        elif self._build_attempts:
+            state = "degraded"
+        else:
+            state = "starting"
+        
+        # Replaced as a whole, so readers never see a half-updated snapshot
+        self._status = {
+            "state": state,
+            "ready": generation is not None,
+            "building": self._building,
+            "generation": generation.id if generation else None,
+            "build_attempts": self._build_attempts,
+            "last_build_at": self._last_build_at,
+            "last_error": self._last_build_error,
+            "next_retry_at": self._next_retry_at,
+            "components": {
+                "vectorstore_loaded": generation is not None,
+                "qa_chain_initialized": generation is not None,
+                "embeddings_ready": generation is not None,
+                # Local providers need no key
+                "google_api_configured": not settings.uses_google() or bool(
+                    settings.GOOGLE_API_KEY and settings.GOOGLE_API_KEY != "your_google_api_key_here"
+                )
+            }
+        }
+    
+    def get_health_snapshot(self) -> Dict[str, Any]:
+        """Latest build/readiness snapshot; O(1), never triggers a build"""
+        return self._status
     
     def get_system_status(self) -> Dict[str, Any]:
         """Get current system status"""
+        return self._status["components"]
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get cache hit/miss and index build statistics"""
+        embedding_cache = None
+        if isinstance(self.embeddings, CachedEmbeddings):
+            embedding_cache = self.embeddings.get_stats()
         return {
-            "vectorstore_loaded": self.vectorstore is not None,
-            "qa_chain_initialized": self.qa_chain is not None,
-            "embeddings_ready": self.embeddings is not None,
-            "google_api_configured": bool(settings.GOOGLE_API_KEY and 
-                                        settings.GOOGLE_API_KEY != "your_google_api_key_here")
+            "embedding_cache": embedding_cache,
+            "answer_cache": self.answer_cache.get_stats() if self.answer_cache else None,
+            "index_build": corpus_ingestor.last_build,
+            "coalescing": self._flights.get_stats()
         }
     
+    def update_metrics(self) -> None:
+        """Refresh the scrape-time gauges (cache counters, index size, readiness)"""
+        cache_stats = self.get_cache_stats()
+        embedding_cache = cache_stats["embedding_cache"]
+        if embedding_cache:
+            metrics.cache_lookups.set_total(embedding_cache["hits"], cache="embedding", result="hit")
+            metrics.cache_lookups.set_total(embedding_cache["misses"], cache="embedding", result="miss")
+            metrics.cache_hit_ratio.set(embedding_cache["hit_ratio"], cache="embedding")
+            metrics.cache_entries.set(embedding_cache["entries"], cache="embedding")
+        answer_cache = cache_stats["answer_cache"]
+        if answer_cache:
+            metrics.cache_lookups.set_total(answer_cache["exact_hits"], cache="answer", result="exact_hit")
+            metrics.cache_lookups.set_total(answer_cache["semantic_hits"], cache="answer", result="semantic_hit")
+            metrics.cache_lookups.set_total(answer_cache["misses"], cache="answer", result="miss")
+            metrics.cache_hit_ratio.set(answer_cache["hit_ratio"], cache="answer")
+            metrics.cache_entries.set(answer_cache["entries"], cache="answer")
+        
+        vectorstore = self.vectorstore
+        metrics.index_vectors.set(vectorstore.index.ntotal if vectorstore is not None else 0)
+        metrics.rag_ready.set(1 if self.is_rag_ready() else 0)
+    
+    def flush_caches(self) -> None:
+        """Persist pending cache entries to disk"""
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.embeddings.store.flush()
+    
     def is_rag_ready(self) -> bool:
         """Check if RAG system is ready"""
-        return self.qa_chain is not None
+        return self._generation is not None
 
 # Create global RAG service instance
 rag_service = RAGService()
@@ -0,0 +1,114 @@
+"""
+Optional re-ranking of retrieved chunks: MMR diversity and a local cross-encoder
+"""
+import logging
+import threading
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+OFF = "off"
+MMR = "mmr"
+CROSS_ENCODER = "cross-encoder"
+BOTH = "both"
+
+
+def mmr(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.7) -> List[int]:
+    """Indices of k candidates chosen by maximal marginal relevance
+
+    Each step picks the candidate with the best trade-off between similarity
+    to the query and dissimilarity to everything already picked. Similarities
+    are one matrix product up front, and each step is a vectorized update.
+    """
+    n = candidates.shape[0]
+    if n == 0:
+        return []
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    unit = candidates / np.where(norms == 0, 1, norms)
+    query_norm = float(np.linalg.norm(query))
+    relevance = unit @ (query / query_norm if query_norm else query)
+    similarity = unit @ unit.T
+
+    selected: List[int] = []
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(redundancy, similarity[pick], out=redundancy)
+    return selected
+
+
+class Reranker:
+    """Re-orders retrieved candidates with MMR and/or a cross-encoder
+
+    The cross-encoder (sentence-transformers) is loaded once with the RAG
+    generation, not on the first request, so its load time never counts
+    against a request's re-rank budget.
+    """
+
+    def __init__(self, mode: str = settings.RERANK_MODE, lambda_mult: float = settings.RERANK_MMR_LAMBDA,
+                 model_name: str = settings.RERANK_CROSS_ENCODER_MODEL):
+        self.mode = mode
+        self.lambda_mult = lambda_mult
+        self.model_name = model_name
+        self._model: Optional[Any] = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != OFF
+
+    @property
+    def uses_mmr(self) -> bool:
+        return self.mode in (MMR, BOTH)
+
+    @property
+    def uses_cross_encoder(self) -> bool:
+        return self.mode in (CROSS_ENCODER, BOTH) and self._model is not None
+
+    def load(self) -> None:
+        """Load the cross-encoder if the mode needs one; falls back to MMR only if it can't be loaded"""
+        if self.mode not in (CROSS_ENCODER, BOTH) or self._model is not None:
+            return
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, device="cpu")
+                logger.info(f"Loaded cross-encoder {self.model_name}")
+            except Exception as e:
+                logger.warning(f"Cross-encoder {self.model_name} unavailable, re-ranking without it: {e}")
+
+    def rerank(self, question: str, query_vector: List[float], scored: List[Tuple[Document, float]],
+               vectors: Optional[np.ndarray], k: int) -> List[Tuple[Document, float]]:
+        """Top k of ``scored`` after re-ranking; ``vectors`` holds one stored embedding per candidate
+
+        The cross-encoder scores every candidate, so it can promote chunks plain
+        search ranked below k. In ``both`` mode MMR first narrows the pool to a
+        diverse 2k for it.
+        """
+        cross_encode = self.uses_cross_encoder and len(scored) > 1
+        if self.uses_mmr and vectors is not None:
+            pool = 2 * k if cross_encode else k
+            order = mmr(np.asarray(query_vector, dtype=np.float32), vectors, pool, self.lambda_mult)
+            scored = [scored[i] for i in order]
+
+        if cross_encode:
+            pairs = [(question, doc.page_content) for doc, _ in scored]
+            relevance = self._model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            order = np.argsort(-np.asarray(relevance), kind="stable")
+            scored = [scored[i] for i in order]
+        return scored[:k]
+
+
+# Create global reranker instance
+reranker = Reranker()
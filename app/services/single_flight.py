@@ -0,0 +1,126 @@
+"""
+Single-flight coalescing of identical in-flight requests
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Broadcast:
+    """Events of one streamed answer, replayed to every subscriber from the start"""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.closed = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def close(self) -> None:
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Dict[str, Any]]:
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.events) or self.closed)
+                pending = self.events[position:]
+                closed = self.closed
+            for event in pending:
+                # Each subscriber gets its own copy, so one request can't leak fields into another's
+                yield dict(event, data=dict(event["data"]))
+            position += len(pending)
+            if closed and position >= len(self.events):
+                return
+
+
+class SingleFlight:
+    """Runs one piece of work per key at a time; concurrent callers with the same key share it
+
+    The work runs as its own task, so a caller that disconnects or times out
+    never cancels it for the others. Keys are dropped as soon as the work
+    finishes: this only merges requests that overlap in time, and the answer
+    cache takes care of later repeats.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _bind_loop(self) -> None:
+        # Tasks belong to one event loop; start afresh if a new loop is running
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._tasks, self._streams, self._loop = {}, {}, loop
+
+    def _joined(self, path: str) -> None:
+        self.coalesced += 1
+        metrics.coalesced_requests.inc(path=path)
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of ``factory()``, shared with concurrent callers using the same key"""
+        self._bind_loop()
+        task = self._tasks.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            tasks = self._tasks
+            task.add_done_callback(lambda done: self._finished(tasks, key, done))
+        else:
+            self._joined("query")
+        return await asyncio.shield(task)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Dict[str, Any]]]) -> AsyncIterator[Dict[str, Any]]:
+        """Events of ``factory()``, with concurrent callers using the same key replaying one stream"""
+        self._bind_loop()
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.leaders += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            task = asyncio.ensure_future(self._pump(factory(), broadcast))
+            streams = self._streams
+            task.add_done_callback(lambda done: self._finished(streams, key, done))
+        else:
+            self._joined("stream")
+        async for event in broadcast.subscribe():
+            yield event
+
+    @staticmethod
+    async def _pump(events: AsyncIterator[Dict[str, Any]], broadcast: _Broadcast) -> None:
+        try:
+            async for event in events:
+                await broadcast.publish(event)
+        except Exception as e:
+            logger.error(f"Shared stream failed: {e}")
+            await broadcast.publish({"event": "error", "data": {"error": str(e)}})
+        finally:
+            await broadcast.close()
+
+    @staticmethod
+    def _finished(flights: Dict[str, Any], key: str, task: asyncio.Task) -> None:
+        flights.pop(key, None)
+        # Mark the error as seen even if every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Requests that did the work versus requests that shared it"""
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._tasks) + len(self._streams)
+        }
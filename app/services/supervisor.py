@@ -0,0 +1,73 @@
+"""
+Background supervisor that brings the RAG system up and keeps retrying until it is ready
+"""
+import logging
+import random
+import threading
+from typing import Optional
+
+from app.core.config import settings
+from app.services.rag_service import RAGService, rag_service
+
+logger = logging.getLogger(__name__)
+
+
+class RAGSupervisor:
+    """Single daemon thread that builds the RAG system, backing off exponentially between failures
+
+    Health endpoints only read the service's status snapshot; this is the one
+    place that (re)initializes, so probes can never start a build.
+    """
+
+    def __init__(self, service: RAGService, backoff_seconds: float = settings.SUPERVISOR_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = settings.SUPERVISOR_MAX_BACKOFF_SECONDS):
+        self.service = service
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start supervising; returns immediately"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="rag-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop after the current build attempt, if any"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def retry_now(self) -> None:
+        """Skip the remaining backoff and try again"""
+        self._wake.set()
+
+    def _delay(self, failures: int) -> float:
+        delay = min(self.backoff_seconds * 2 ** (failures - 1), self.max_backoff_seconds)
+        # Jitter keeps restarted workers from retrying in lockstep
+        return delay * random.uniform(0.8, 1.2)
+
+    def _run(self) -> None:
+        failures = 0
+        while not self._stopping.is_set():
+            if self.service.ensure_ready():
+                if failures:
+                    logger.info(f"RAG system ready after {failures} failed attempt(s)")
+                self.service.schedule_retry(None)
+                return
+
+            failures += 1
+            delay = self._delay(failures)
+            logger.warning(f"RAG initialization failed (attempt {failures}); retrying in {delay:.1f}s")
+            self.service.schedule_retry(delay)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+
+# Create global supervisor instance
+rag_supervisor = RAGSupervisor(rag_service)
@@ -0,0 +1,59 @@
+"""
+Embedding-based gym-topic gate built from the indexed corpus
+"""
+import logging
+from typing import List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class TopicGate:
+    """Scores a query embedding by its cosine similarity to the nearest corpus topic centroid"""
+
+    def __init__(self, centroids: np.ndarray, threshold: float):
+        self.centroids = _normalize_rows(np.asarray(centroids, dtype=np.float32))
+        self.threshold = threshold
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: FAISS, n_centroids: int, threshold: float) -> Optional["TopicGate"]:
+        """Cluster the indexed chunk vectors into topic centroids"""
+        index = vectorstore.index
+        if index.ntotal == 0:
+            return None
+        try:
+            vectors = _normalize_rows(index.reconstruct_n(0, index.ntotal).astype(np.float32))
+        except RuntimeError as e:
+            logger.warning(f"Topic gate unavailable, index vectors cannot be reconstructed: {e}")
+            return None
+
+        if index.ntotal <= n_centroids:
+            centroids = vectors
+        else:
+            kmeans = faiss.Kmeans(vectors.shape[1], n_centroids, niter=20, spherical=True, seed=1234, verbose=False)
+            kmeans.train(vectors)
+            centroids = kmeans.centroids
+
+        logger.info(f"Built topic gate with {len(centroids)} centroids (threshold {threshold})")
+        return cls(centroids, threshold)
+
+    def score(self, vector: List[float]) -> float:
+        """Highest cosine similarity between the query and any topic centroid"""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if not norm or query.shape[0] != self.centroids.shape[1]:
+            return 0.0
+        return float(np.max(self.centroids @ (query / norm)))
+
+    def is_on_topic(self, vector: List[float]) -> bool:
+        """Whether a query embedding is close enough to the corpus to answer"""
+        return self.score(vector) >= self.threshold
@@ -2,26 +2,78 @@
 Content filtering utilities for the GymPro chatbot
 """
 import logging
-from typing import Dict, Any
+import re
+from functools import lru_cache
+from typing import Dict, Any, Iterable, List, Optional
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Separator allowed between the words of a phrase keyword ("warm up", "warm-up")
+_PHRASE_GAP = r"[\s\-]+"
+
+def _trie_pattern(node: Dict[str, Any]) -> str:
+    """Render a character trie as a regex alternation with shared prefixes factored out"""
+    end = "" in node
+    branches = []
+    for char, child in sorted((key, value) for key, value in node.items() if key):
+        token = _PHRASE_GAP if char == " " else re.escape(char)
+        branches.append(token + _trie_pattern(child))
+    if not branches:
+        return ""
+    if len(branches) == 1 and not end:
+        return branches[0]
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if end else pattern
+
+class KeywordMatcher:
+    """Whole-word keyword and phrase matcher compiled into a single regex
+    
+    The keywords are folded into a trie before compiling, so a scan costs
+    O(message length) no matter how many keywords there are. Plurals ("squats")
+    and hyphenated phrases ("warm-up") match; substrings ("feedback") do not.
+    """
+    
+    def __init__(self, keywords: Iterable[str]):
+        trie: Dict[str, Any] = {}
+        for keyword in keywords:
+            words = keyword.lower().split()
+            if not words:
+                continue
+            node = trie
+            for char in " ".join(words):
+                node = node.setdefault(char, {})
+            node[""] = True
+        body = _trie_pattern(trie) if trie else r"(?!)"
+        self.pattern = re.compile(rf"\b{body}(?:e?s)?\b", re.IGNORECASE)
+    
+    def search(self, text: str) -> Optional[str]:
+        """Return the first keyword occurrence in the text, if any"""
+        match = self.pattern.search(text)
+        return match.group(0) if match else None
+
 class ContentFilter:
     """Service for filtering and categorizing user messages"""
     
-    def __init__(self):
-        self.gym_keywords = settings.GYM_KEYWORDS
+    def __init__(self, keywords: Iterable[str] = settings.GYM_KEYWORDS, memo_size: int = 4096):
+        self.gym_keywords = set(keywords)
+        self.matcher = KeywordMatcher(self.gym_keywords)
+        # Messages are classified by both validate_message and get_fallback_response
+        self._classify = lru_cache(maxsize=memo_size)(self._match)
+    
+    def _match(self, message: str) -> bool:
+        return self.matcher.search(message) is not None
     
     def is_gym_related(self, message: str) -> bool:
         """Check if the message is related to gym/fitness"""
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in self.gym_keywords)
+        return self._classify(message)
     
-    def get_fallback_response(self, message: str) -> str:
-        """Provide a fallback response when RAG is not available"""
-        if not self.is_gym_related(message):
+    def get_fallback_response(self, message: str, gym_related: Optional[bool] = None) -> str:
+        """Provide a fallback response when RAG is not available or the message is off topic"""
+        if gym_related is None:
+            gym_related = self.is_gym_related(message)
+        if not gym_related:
             return """I'm GymPro AI, your dedicated fitness assistant! 🏋️‍♂️
 
 I specialize in helping with:
@@ -78,5 +130,9 @@ Feel free to ask about specific exercises, workout plans, or nutrition guidance!
             "message": message
         }
 
+    def validate_messages(self, messages: List[str]) -> List[Dict[str, Any]]:
+        """Validate and categorize a batch of messages in one pass"""
+        return [self.validate_message(message) for message in messages]
+
 # Create global content filter instance
 content_filter = ContentFilter()
@@ -0,0 +1,203 @@
+"""
+In-process metrics exposed on /metrics in the Prometheus text format
+"""
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Seconds; spans sub-millisecond filtering up to slow LLM generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Shared label handling; subclasses store one value per label combination"""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels: str) -> None:
+        """Mirror a running total kept elsewhere, e.g. a cache's own hit counter"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be set at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts plus sum and count, per label combination"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+# Create global metrics registry and the application's metrics
+registry = MetricsRegistry()
+
+stage_seconds = registry.register(Histogram(
+    "gympro_stage_duration_seconds", "Time spent in each request stage", ["stage"]
+))
+request_seconds = registry.register(Histogram(
+    "gympro_request_duration_seconds", "Time to response headers per HTTP request", ["method", "status"]
+))
+requests_in_flight = registry.register(Gauge(
+    "gympro_requests_in_flight", "HTTP requests currently being handled"
+))
+coalesced_requests = registry.register(Counter(
+    "gympro_coalesced_requests_total", "Requests answered by joining an identical request already in flight", ["path"]
+))
+fallbacks = registry.register(Counter(
+    "gympro_fallbacks_total", "Answers served from canned fallback responses", ["reason"]
+))
+cache_lookups = registry.register(Counter(
+    "gympro_cache_lookups_total", "Cache lookups since startup", ["cache", "result"]
+))
+cache_hit_ratio = registry.register(Gauge(
+    "gympro_cache_hit_ratio", "Cache hits / lookups since startup", ["cache"]
+))
+cache_entries = registry.register(Gauge(
+    "gympro_cache_entries", "Entries held by each cache", ["cache"]
+))
+index_vectors = registry.register(Gauge(
+    "gympro_index_vectors", "Vectors in the serving FAISS index"
+))
+llm_input_tokens = registry.register(Counter(
+    "gympro_llm_input_tokens_total", "Prompt tokens reported by the LLM, by whether its prefix cache served them", ["cache"]
+))
+rerank_skipped = registry.register(Counter(
+    "gympro_rerank_skipped_total", "Requests served in retrieval order because re-ranking failed", ["reason"]
+))
+context_tokens = registry.register(Histogram(
+    "gympro_context_tokens", "Estimated tokens of retrieved context packed into each prompt", ["mode"],
+    buckets=(50, 100, 200, 300, 400, 600, 800, 1000, 1500, 2000, 3000)
+))
+sessions = registry.register(Gauge(
+    "gympro_sessions", "Conversation sessions held in memory"
+))
+session_memory_bytes = registry.register(Gauge(
+    "gympro_session_memory_bytes", "Text held by in-memory conversation sessions"
+))
+rag_ready = registry.register(Gauge(
+    "gympro_rag_ready", "1 if the RAG system is serving, 0 in fallback mode"
+))
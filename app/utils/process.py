@@ -0,0 +1,52 @@
+"""
+Process-level helpers for the production server: CPU budget and memory usage
+"""
+import os
+from pathlib import Path
+from typing import Dict
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS either
+    resource = None
+
+
+def cpu_count() -> int:
+    """CPUs this process may use, honouring CPU affinity and a cgroup v2 quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        cpus = os.cpu_count() or 1
+
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def memory_usage() -> Dict[str, float]:
+    """Resident memory of this process in MB
+
+    ``rss`` counts pages shared with the master; ``private`` is what this
+    process alone holds, and ``pss`` splits shared pages among their users.
+    Empty where neither /proc nor ``resource`` is available.
+    """
+    try:
+        fields = {}
+        for line in Path("/proc/self/smaps_rollup").read_text().splitlines()[1:]:
+            name, value = line.split(":", 1)
+            fields[name] = int(value.split()[0]) / 1024
+        return {
+            "rss": round(fields["Rss"], 1),
+            "pss": round(fields["Pss"], 1),
+            "private": round(fields["Private_Clean"] + fields["Private_Dirty"], 1),
+        }
+    except (OSError, KeyError, ValueError):
+        if resource is None:
+            return {}
+        # Peak RSS only: KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"rss": round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)}
@@ -0,0 +1,86 @@
+"""
+Per-request stage timing, reported in the Server-Timing response header
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from app.utils import metrics
+
+_current: ContextVar[Optional["StageTimings"]] = ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    """Milliseconds spent in each pipeline stage (filter, embed, search, llm) of one request"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, ms: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def server_timing(self) -> str:
+        """Format as a Server-Timing header value"""
+        return ", ".join(f"{name};dur={ms:.2f}" for name, ms in self.stages.items())
+
+
+def current_timings() -> Optional[StageTimings]:
+    """Timings of the request being handled, if any"""
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block, recording it in the stage histogram and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def record(name: str, seconds: float) -> None:
+    """Record a stage duration measured elsewhere, e.g. time to first token"""
+    metrics.stage_seconds.observe(seconds, stage=name)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds * 1000)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware that collects stage timings per request and sends them as Server-Timing
+
+    Streaming responses send headers first, so they only report stages that
+    finished before the first byte. Also tracks in-flight requests and time to
+    response headers for /metrics.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = StageTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        metrics.requests_in_flight.inc()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - start
+                timings.add("app", elapsed * 1000)
+                metrics.request_seconds.observe(elapsed, method=scope["method"], status=str(message["status"]))
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            metrics.requests_in_flight.dec()
+            _current.reset(token)
@@ -0,0 +1,20 @@
+"""
+Fast token estimates for budgeting prompt text without a tokenizer
+"""
+
+# English prose averages about four characters per token for Gemini-style tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of a string"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, at a word boundary where possible"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+    head, space, _ = cut.rpartition(" ")
+    return (head if space and head else cut).rstrip() + "…"
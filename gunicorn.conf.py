@@ -0,0 +1,79 @@
+"""
+Gunicorn configuration for the production server
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The master loads (or builds) the RAG index once before forking, so workers
+share it copy-on-write; the FAISS index file is memory-mapped read-only on
+top of that. Send HUP for a rolling restart: the master refreshes the index
+from disk, new workers start, then the old ones finish their requests and exit.
+"""
+import gc
+import logging
+import os
+import time
+
+import faiss
+
+from app.core.config import settings
+from app.utils.process import cpu_count, memory_usage
+
+logger = logging.getLogger("gunicorn.error")
+
+bind = f"{settings.HOST}:{os.getenv('PORT', '8001')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = settings.WEB_CONCURRENCY or cpu_count()
+preload_app = True
+
+# Worker heartbeat; long LLM calls run on the event loop and don't block it
+timeout = 120
+graceful_timeout = settings.GRACEFUL_TIMEOUT_SECONDS
+keepalive = 5
+max_requests = settings.WORKER_MAX_REQUESTS
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+
+
+def _preload_index(server) -> None:
+    """Build or load the RAG generation in the master, then hand workers a clean fork"""
+    from app.services.rag_service import rag_service
+
+    start = time.perf_counter()
+    if rag_service.initialize_rag_system():
+        logger.info(f"Preloaded RAG index in {time.perf_counter() - start:.1f}s "
+                    f"(master memory {memory_usage()})")
+    else:
+        logger.warning("RAG preload failed; workers will retry in the background")
+    rag_service.prepare_fork()
+    # Keep the garbage collector from touching (and un-sharing) preloaded objects
+    gc.freeze()
+
+
+def when_ready(server):
+    # libgomp's thread pool does not survive fork, so the master never starts one
+    faiss.omp_set_num_threads(1)
+    if settings.PRELOAD_INDEX:
+        _preload_index(server)
+    logger.info(f"Starting {server.num_workers} workers")
+
+
+def on_reload(server):
+    # Runs before replacement workers are forked on HUP
+    if settings.PRELOAD_INDEX:
+        from app.services.embedding_cache import reopen_cache_stores
+        reopen_cache_stores()
+        _preload_index(server)
+
+
+def post_fork(server, worker):
+    worker.started_at = time.perf_counter()
+    faiss.omp_set_num_threads(settings.FAISS_THREADS_PER_WORKER)
+    from app.services.rag_service import rag_service
+    rag_service.after_fork()
+
+
+def post_worker_init(worker):
+    elapsed = time.perf_counter() - getattr(worker, "started_at", time.perf_counter())
+    worker.log.info(f"Worker {worker.pid} ready in {elapsed:.2f}s, memory {memory_usage()} MB")
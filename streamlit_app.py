@@ -5,7 +5,8 @@ import streamlit as st
 import requests
 import json
 import os
-from typing import Dict, Any
+import uuid
+from typing import Dict, Any, Iterator, Optional, Tuple
 import time
 
 # Page configuration
@@ -92,12 +93,12 @@ def check_api_health() -> Dict[str, Any]:
             "error": str(e)
         }
 
-def send_chat_message(message: str) -> Dict[str, Any]:
+def send_chat_message(message: str, session_id: Optional[str] = None) -> Dict[str, Any]:
     """Send a message to the chatbot API"""
     try:
         response = requests.post(
             f"{API_BASE_URL}/chat",
-            json={"message": message},
+            json={"message": message, "session_id": session_id},
             timeout=30
         )
         return {
@@ -112,6 +113,31 @@ def send_chat_message(message: str) -> Dict[str, Any]:
             "error": str(e)
         }
 
+def stream_chat_message(message: str, session_id: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Send a message to the streaming endpoint and yield (event, data) pairs"""
+    try:
+        with requests.post(
+            f"{API_BASE_URL}/chat/stream",
+            json={"message": message, "session_id": session_id},
+            stream=True,
+            timeout=30
+        ) as response:
+            if response.status_code != 200:
+                yield "error", {"error": response.text}
+                return
+            
+            event, data = "message", ""
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data += line[5:].strip()
+                elif not line and data:
+                    yield event, json.loads(data)
+                    event, data = "message", ""
+    except Exception as e:
+        yield "error", {"error": str(e)}
+
 def get_api_status() -> Dict[str, Any]:
     """Get detailed API status"""
     try:
@@ -178,8 +204,14 @@ def main():
         # Clear chat button
         if st.button("🗑️ Clear Chat History"):
             st.session_state.messages = []
+            # A new server-side session, so old turns stop informing follow-ups
+            st.session_state.session_id = uuid.uuid4().hex
             st.rerun()
 
+    # Server-side conversation memory is keyed by this id
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -235,33 +267,44 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        # Show thinking spinner
-        with st.spinner("🤔 GymPro AI is thinking..."):
-            # Send message to API
-            response = send_chat_message(prompt)
-            
-            if response["success"] and response["data"]:
-                data = response["data"]
-                assistant_message = data.get("response", "Sorry, I couldn't generate a response.")
+        # Stream the answer into a placeholder as tokens arrive
+        placeholder = st.empty()
+        placeholder.markdown("🤔 GymPro AI is thinking...")
+        
+        assistant_message = ""
+        sources = []
+        error = None
+        for event, data in stream_chat_message(prompt, st.session_state.session_id):
+            if event == "sources":
                 sources = data.get("sources", [])
-                
-                # Add assistant response to chat history
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": assistant_message,
-                    "sources": sources
-                })
-                
-            else:
-                error_msg = "Sorry, I encountered an error while processing your request."
-                if response.get("error"):
-                    error_msg += f" Error: {response['error']}"
-                
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_msg,
-                    "sources": []
-                })
+            elif event == "token":
+                assistant_message += data.get("text", "")
+                placeholder.markdown(f"""
+                <div class="chat-message assistant-message">
+                    <strong>🏋️ GymPro AI:</strong><br>
+                    {assistant_message}
+                </div>
+                """, unsafe_allow_html=True)
+            elif event == "error":
+                error = data.get("error")
+        
+        if assistant_message:
+            # Add assistant response to chat history
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": assistant_message,
+                "sources": sources
+            })
+        else:
+            error_msg = "Sorry, I encountered an error while processing your request."
+            if error:
+                error_msg += f" Error: {error}"
+            
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": error_msg,
+                "sources": []
+            })
         
         # Rerun to show the new message
         st.rerun()
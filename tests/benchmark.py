@@ -0,0 +1,244 @@
+"""
+Offline load test and latency benchmark for the GymPro RAG Chatbot API
+
+Replays a JSONL workload against the FastAPI app in-process, with the local
+embedding and LLM providers at configurable latency, so it needs no network
+and no Google API key. Per-stage timings come from the Server-Timing header.
+
+Usage:
+    python tests/benchmark.py --concurrency 8 --requests 200
+    python tests/benchmark.py --rate 40 --duration 30 --first-token-ms 600 --tokens-per-second 40
+    python tests/benchmark.py --json --max-p99-ms 1500
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Add the project root to the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+DEFAULT_WORKLOAD = Path(__file__).parent / "workload.jsonl"
+MESSAGE_FIELDS = ("message", "question", "text", "title")
+STAGES = ("filter", "embed", "search", "rerank", "prompt", "llm", "app")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workload", type=Path, default=DEFAULT_WORKLOAD,
+                        help="JSONL file, one request per line (message/question/text/title field)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Concurrent clients in closed-loop mode")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Total requests in closed-loop mode")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Open-loop arrival rate in requests/s (overrides --concurrency)")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="Open-loop run time in seconds")
+    parser.add_argument("--embed-latency-ms", type=float, default=40.0,
+                        help="Local embedding latency per call")
+    parser.add_argument("--first-token-ms", type=float, default=300.0,
+                        help="Local LLM time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0,
+                        help="Local LLM generation rate after the first token (0 = instant)")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Keep the answer cache on (off by default so every request runs the pipeline)")
+    parser.add_argument("--embedding-cache", action="store_true",
+                        help="Keep the query embedding cache on")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="Keep request coalescing on (off by default so identical concurrent requests each run)")
+    parser.add_argument("--score-policy", action="store_true",
+                        help="Keep the retrieval score thresholds (local vectors score low, so most answers skip the LLM)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float, default=0.0,
+                        help="Exit with status 1 if p99 latency exceeds this")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """Point settings at a throwaway index and the local providers; must run before importing app"""
+    os.environ["VECTOR_STORE_PATH"] = tempfile.mkdtemp(prefix="gympro-bench-")
+    os.environ["LLM_PROVIDER"] = "local"
+    os.environ["EMBEDDING_PROVIDER"] = "local"
+    os.environ["LOCAL_EMBEDDING_LATENCY_MS"] = str(args.embed_latency_ms)
+    os.environ["LOCAL_LLM_FIRST_TOKEN_MS"] = str(args.first_token_ms)
+    os.environ["LOCAL_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["ANSWER_CACHE_ENABLED"] = str(args.answer_cache)
+    os.environ["EMBEDDING_CACHE_ENABLED"] = str(args.embedding_cache)
+    os.environ["COALESCE_REQUESTS"] = str(args.coalesce)
+    if not args.score_policy:
+        os.environ["RETRIEVAL_MIN_SCORE"] = "0"
+        os.environ["RETRIEVAL_BRIEF_SCORE"] = "0"
+
+
+def load_workload(path: Path) -> List[str]:
+    """Messages from a JSONL file; lines without a usable message field are skipped"""
+    messages = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            message = next((record[field] for field in MESSAGE_FIELDS if record.get(field)), None)
+            if message:
+                messages.append(str(message))
+    if not messages:
+        raise SystemExit(f"No messages found in {path}")
+    return messages
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Stage durations (ms) from a Server-Timing header value"""
+    stages = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        match = re.search(r"dur=([\d.]+)", params)
+        if name and match:
+            stages[name] = float(match.group(1))
+    return stages
+
+
+async def send(client, message: str, samples: List[Dict[str, Any]], start: Optional[float] = None) -> None:
+    """Post one chat request and record its latency, measured from ``start`` if given"""
+    start = start if start is not None else time.perf_counter()
+    try:
+        response = await client.post("/chat/", json={"message": message})
+        status = response.status_code
+        stages = parse_server_timing(response.headers.get("server-timing", ""))
+    except Exception:
+        status, stages = 0, {}
+    samples.append({
+        "latency_ms": (time.perf_counter() - start) * 1000,
+        "ok": status == 200,
+        "stages": stages,
+    })
+
+
+async def run_closed_loop(client, messages: List[str], concurrency: int, total: int,
+                          samples: List[Dict[str, Any]]) -> None:
+    """A fixed number of clients, each sending its next request as soon as the last returns"""
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for i in counter:
+            await send(client, messages[i % len(messages)], samples)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_open_loop(client, messages: List[str], rate: float, duration: float,
+                        samples: List[Dict[str, Any]]) -> None:
+    """Requests arrive on a fixed schedule whether or not earlier ones have finished
+
+    Latency counts from the scheduled arrival, so queueing delay is not hidden.
+    """
+    total = int(rate * duration)
+    begin = time.perf_counter()
+    tasks = []
+    for i in range(total):
+        scheduled = begin + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(client, messages[i % len(messages)], samples, scheduled)))
+    await asyncio.gather(*tasks)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples: List[Dict[str, Any]], elapsed: float, args: argparse.Namespace) -> Dict[str, Any]:
+    latencies = [sample["latency_ms"] for sample in samples]
+    stages = {}
+    for name in STAGES:
+        values = [sample["stages"][name] for sample in samples if name in sample["stages"]]
+        if values:
+            stages[name] = {
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "requests": len(values),
+            }
+    return {
+        "mode": f"open loop @ {args.rate:g} req/s" if args.rate else f"closed loop x{args.concurrency}",
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if not sample["ok"]),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies, default=0.0), 2),
+        },
+        "stages": stages,
+        "backends": {
+            "embed_latency_ms": args.embed_latency_ms,
+            "first_token_ms": args.first_token_ms,
+            "tokens_per_second": args.tokens_per_second,
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nBenchmark: {report['mode']}")
+    print(f"  requests   {report['requests']} ({report['errors']} errors) in {report['elapsed_s']}s")
+    print(f"  throughput {report['throughput_rps']} req/s")
+    latency = report["latency_ms"]
+    print(f"  latency    p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  max {latency['max']}ms")
+    print("  stages:")
+    for name, stage in report["stages"].items():
+        print(f"    {name:<8} mean {stage['mean_ms']:>9.2f}ms  p95 {stage['p95_ms']:>9.2f}ms  ({stage['requests']} requests)")
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    configure_environment(args)
+
+    import httpx
+    from app.main import app
+    from app.services.rag_service import rag_service
+
+    messages = load_workload(args.workload)
+    samples: List[Dict[str, Any]] = []
+
+    # ASGITransport does not run lifespan events, so run them here
+    async with app.router.lifespan_context(app):
+        # Startup builds in the background; measure the ready system only
+        if not await asyncio.to_thread(rag_service.ensure_ready):
+            raise SystemExit("RAG system failed to initialize")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            start = time.perf_counter()
+            if args.rate > 0:
+                await run_open_loop(client, messages, args.rate, args.duration, samples)
+            else:
+                await run_closed_loop(client, messages, args.concurrency, args.requests, samples)
+            elapsed = time.perf_counter() - start
+
+    report = summarize(samples, elapsed, args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.max_p99_ms and report["latency_ms"]["p99"] > args.max_p99_ms:
+        print(f"p99 latency {report['latency_ms']['p99']}ms exceeds --max-p99-ms {args.max_p99_ms}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
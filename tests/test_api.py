@@ -4,6 +4,8 @@ Test suite for the GymPro RAG Chatbot API
 import requests
 import json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Add the project root to the path
@@ -73,6 +75,29 @@ def test_detailed_health():
         print("-" * 60)
         return False
 
+def test_probes():
+    """Test the liveness and readiness probes"""
+    try:
+        print_colored("🩺 Testing Liveness and Readiness Probes", Colors.BLUE + Colors.BOLD)
+        live = requests.get(f"{BASE_URL}/live")
+        ready = requests.get(f"{BASE_URL}/ready")
+        print(f"Live: {live.status_code}, Ready: {ready.status_code}")
+        
+        state = ready.json().get("state")
+        passed = live.status_code == 200 and (ready.status_code == 200) == (state == "ready")
+        if passed:
+            print_colored(f"✅ Probes consistent (state: {state})", Colors.GREEN)
+        else:
+            print_colored(f"❌ Unexpected probe responses: {live.text} / {ready.text}", Colors.RED)
+        
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Probe test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
 def test_chat_endpoint():
     """Test the chat endpoint with various questions"""
     test_cases = [
@@ -146,6 +171,191 @@ def test_chat_endpoint():
     
     return passed == total
 
+def test_stream_endpoint():
+    """Test the server-sent event streaming endpoint"""
+    try:
+        print_colored("📡 Testing Streaming Chat Endpoint", Colors.BLUE + Colors.BOLD)
+        payload = {"message": "How do I perform a proper deadlift?"}
+        response = requests.post(f"{BASE_URL}/chat/stream", json=payload, stream=True)
+        print(f"Status: {response.status_code}")
+        
+        events = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                events.append(line[6:].strip())
+        
+        passed = (
+            response.status_code == 200
+            and events[:1] == ["sources"]
+            and events[-1:] == ["done"]
+            and "token" in events
+        )
+        if passed:
+            print_colored(f"✅ Stream completed ({events.count('token')} token events)", Colors.GREEN)
+        else:
+            print_colored(f"❌ Unexpected event sequence: {events[:5]}...", Colors.RED)
+        
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Streaming test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
+def test_batch_endpoint():
+    """Test the NDJSON batch chat endpoint"""
+    try:
+        print_colored("📦 Testing Batch Chat Endpoint", Colors.BLUE + Colors.BOLD)
+        payload = {"messages": [
+            "What muscles do squats work?",
+            "How many rest days should I take?",
+            "What's the capital of France?"
+        ]}
+        response = requests.post(f"{BASE_URL}/chat/batch", json=payload, stream=True)
+        print(f"Status: {response.status_code}")
+        
+        lines = [json.loads(line) for line in response.iter_lines(decode_unicode=True) if line]
+        items = sorted((line for line in lines if "index" in line), key=lambda item: item["index"])
+        summary = lines[-1] if lines else {}
+        
+        passed = (
+            response.status_code == 200
+            and [item["index"] for item in items] == [0, 1, 2]
+            and summary.get("done") is True
+            and not items[2]["is_gym_related"]
+        )
+        if passed:
+            print_colored(f"✅ Batch completed ({summary['succeeded']}/{summary['count']} succeeded "
+                          f"in {summary['total_ms']}ms)", Colors.GREEN)
+        else:
+            print_colored(f"❌ Unexpected batch response: {lines[:2]}...", Colors.RED)
+        
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Batch test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
+def test_session_memory():
+    """Test that a follow-up in the same session is condensed with the earlier topic"""
+    try:
+        print_colored("🧠 Testing Conversation Memory", Colors.BLUE + Colors.BOLD)
+        session_id = f"test-{int(time.time())}"
+        first = requests.post(f"{BASE_URL}/chat", json={"message": "How do I do a proper squat?", "session_id": session_id})
+        follow_up = requests.post(f"{BASE_URL}/chat", json={"message": "How many sets of that?", "session_id": session_id})
+        print(f"Status: {first.status_code}, {follow_up.status_code}")
+        
+        data = follow_up.json() if follow_up.status_code == 200 else {}
+        condensed = data.get("condensed_query") or ""
+        passed = data.get("session_id") == session_id and "squat" in condensed.lower()
+        if passed:
+            print_colored(f"✅ Follow-up condensed: '{condensed}'", Colors.GREEN)
+        else:
+            print_colored(f"❌ Follow-up not condensed: {follow_up.text[:200]}", Colors.RED)
+        
+        sessions = requests.get(f"{BASE_URL}/stats").json().get("sessions") or {}
+        print(f"Sessions: {sessions.get('sessions')}, memory: {sessions.get('memory_bytes')} bytes")
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Session test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
+def test_coalescing():
+    """Test that concurrent identical questions all get the same answer"""
+    try:
+        print_colored("🔗 Testing Request Coalescing", Colors.BLUE + Colors.BOLD)
+        # A fresh question so the answer cache can't serve the duplicates
+        message = f"How long should I rest between sets of squats? ({int(time.time())})"
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: requests.post(f"{BASE_URL}/chat", json={"message": message}), range(8)))
+        print(f"Status: {sorted({response.status_code for response in responses})}")
+        
+        answers = {response.json().get("response") for response in responses if response.status_code == 200}
+        coalescing = requests.get(f"{BASE_URL}/stats").json().get("coalescing") or {}
+        passed = all(response.status_code == 200 for response in responses) and len(answers) == 1 and "coalesced" in coalescing
+        if passed:
+            print_colored(f"✅ Same answer for all requests; leaders: {coalescing.get('leaders')}, coalesced: {coalescing.get('coalesced')}", Colors.GREEN)
+        else:
+            print_colored(f"❌ Concurrent answers differ or stats missing: {len(answers)} answers, {coalescing}", Colors.RED)
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Coalescing test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
+def test_coalesced_stream_isolation():
+    """Test that a coalesced stream never carries another request's session id"""
+    try:
+        print_colored("🔒 Testing Coalesced Stream Isolation", Colors.BLUE + Colors.BOLD)
+        message = f"What is a good warm-up before bench press? ({int(time.time())})"
+        session_id = f"private-{int(time.time())}"
+        payloads = [{"message": message, "session_id": session_id}, {"message": message}]
+        
+        def done_event(payload):
+            response = requests.post(f"{BASE_URL}/chat/stream", json=payload, stream=True)
+            data, event = {}, None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "done":
+                    data = json.loads(line[5:])
+            return data
+        
+        # The session request goes first, so it leads the shared stream and sees each event first
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(done_event, payloads[0])
+            time.sleep(0.05)
+            second = pool.submit(done_event, payloads[1])
+            with_session, anonymous = first.result(), second.result()
+        
+        passed = with_session.get("session_id") == session_id and "session_id" not in anonymous
+        if passed:
+            print_colored("✅ Session id only returned to its own request", Colors.GREEN)
+        else:
+            print_colored(f"❌ Session id leaked: {anonymous.get('session_id')}", Colors.RED)
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Stream isolation test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
+def test_metrics_endpoint():
+    """Test the Prometheus metrics endpoint"""
+    try:
+        print_colored("📈 Testing Metrics Endpoint", Colors.BLUE + Colors.BOLD)
+        response = requests.get(f"{BASE_URL}/metrics")
+        print(f"Status: {response.status_code}")
+        
+        passed = (
+            response.status_code == 200
+            and "# TYPE gympro_stage_duration_seconds histogram" in response.text
+            and "gympro_index_vectors" in response.text
+        )
+        if passed:
+            stages = sorted({line.split('stage="')[1].split('"')[0]
+                             for line in response.text.splitlines() if line.startswith("gympro_stage_duration_seconds_count")})
+            print_colored(f"✅ Metrics exposed (stages: {', '.join(stages) or 'none yet'})", Colors.GREEN)
+        else:
+            print_colored(f"❌ Unexpected metrics response: {response.text[:200]}", Colors.RED)
+        
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Metrics test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
 def test_reset_endpoint():
     """Test the system reset endpoint"""
     try:
@@ -153,23 +363,114 @@ def test_reset_endpoint():
         response = requests.post(f"{BASE_URL}/reset")
         print(f"Status: {response.status_code}")
         
-        if response.status_code == 200:
-            data = response.json()
-            print_colored(f"✅ Reset successful", Colors.GREEN)
-            print(f"Status: {data.get('status')}")
-            print(f"Message: {data.get('message')}")
-        else:
+        if response.status_code != 200:
             print_colored(f"❌ Reset failed", Colors.RED)
             print(f"Response: {response.text}")
+            print("-" * 60)
+            return False
+        
+        data = response.json()
+        print(f"Status: {data.get('status')}")
+        print(f"Message: {data.get('message')}")
+        
+        # The rebuild runs in the background; poll until it finishes
+        job = {"status": "pending"}
+        for _ in range(120):
+            job = requests.get(f"{BASE_URL}/jobs/{data['job_id']}").json()
+            if job["status"] not in ("pending", "running"):
+                break
+            time.sleep(1)
+        
+        passed = job["status"] == "succeeded"
+        if passed:
+            print_colored(f"✅ Reset successful: {job.get('message')}", Colors.GREEN)
+        else:
+            print_colored(f"❌ Reset job ended as {job['status']}: {job.get('message')}", Colors.RED)
         
         print("-" * 60)
-        return response.status_code == 200
+        return passed
         
     except Exception as e:
         print_colored(f"❌ Reset test failed: {e}", Colors.RED)
         print("-" * 60)
         return False
 
+def test_embedding_cache_task_kinds():
+    """Test that query and document embeddings of the same text are cached separately (no server needed)"""
+    try:
+        print_colored("🗂️ Testing Embedding Cache Task Kinds", Colors.BLUE + Colors.BOLD)
+        import tempfile
+        from langchain_core.embeddings import Embeddings
+        from app.services.embedding_cache import CachedEmbeddings, EmbeddingCacheStore
+        
+        class TaskEmbeddings(Embeddings):
+            """Returns a different vector per task, like Gemini's query and document task types"""
+            def embed_documents(self, texts):
+                return [[1.0, 0.0] for _ in texts]
+            
+            def embed_query(self, text):
+                return [0.0, 1.0]
+        
+        with tempfile.TemporaryDirectory() as path:
+            cached = CachedEmbeddings(TaskEmbeddings(), "test-model", EmbeddingCacheStore(Path(path), max_entries=8))
+            text = "How do I do a proper squat?"
+            document = cached.embed_documents([text])[0]
+            query = cached.embed_query(text)
+            # Served from cache the second time, each under its own kind
+            passed = (
+                document == [1.0, 0.0] and query == [0.0, 1.0]
+                and cached.embed_documents([text])[0] == document and cached.embed_query(text) == query
+                and cached.hits == 2 and cached.misses == 2
+            )
+            cached.store.close()
+        
+        if passed:
+            print_colored("✅ Query and document vectors cached separately", Colors.GREEN)
+        else:
+            print_colored(f"❌ Cache mixed task kinds: document {document}, query {query}", Colors.RED)
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ Embedding cache test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
+def test_jsonl_loader():
+    """Test that malformed JSONL records are skipped without failing the file (no server needed)"""
+    try:
+        print_colored("📄 Testing JSONL Corpus Loading", Colors.BLUE + Colors.BOLD)
+        import tempfile
+        from app.services.document_loader import iter_chunks
+        
+        lines = [
+            json.dumps({"title": "Squat", "text": "Keep your chest up and push through your heels."}),
+            json.dumps({"title": "Numbers", "text": 42}),
+            json.dumps({"text": ["not", "a", "string"]}),
+            json.dumps({"content": None}),
+            "{not json",
+            json.dumps({"heading": 7, "content": "Rest two minutes between heavy sets."}),
+        ]
+        with tempfile.TemporaryDirectory() as path:
+            corpus = Path(path) / "corpus.jsonl"
+            corpus.write_text("\n".join(lines) + "\n", encoding="utf-8")
+            chunks = list(iter_chunks(corpus, "corpus.jsonl"))
+        
+        texts = [chunk.page_content for chunk in chunks]
+        sections = [chunk.metadata.get("section") for chunk in chunks]
+        passed = len(chunks) == 2 and "heels" in texts[0] and "two minutes" in texts[1] and sections == ["Squat", None]
+        if passed:
+            print_colored("✅ Bad records skipped, 2 chunks loaded", Colors.GREEN)
+        else:
+            print_colored(f"❌ Unexpected chunks: {texts}", Colors.RED)
+        print("-" * 60)
+        return passed
+        
+    except Exception as e:
+        print_colored(f"❌ JSONL loader test failed: {e}", Colors.RED)
+        print("-" * 60)
+        return False
+
 def main():
     """Run all tests"""
     print_colored("🚀 GymPro RAG Chatbot API Test Suite", Colors.PURPLE + Colors.BOLD)
@@ -178,7 +479,16 @@ def main():
     tests = [
         ("Health Check", test_health_endpoint),
         ("Detailed Health", test_detailed_health),
+        ("Liveness/Readiness", test_probes),
         ("Chat Functionality", test_chat_endpoint),
+        ("Streaming Chat", test_stream_endpoint),
+        ("Batch Chat", test_batch_endpoint),
+        ("Conversation Memory", test_session_memory),
+        ("Request Coalescing", test_coalescing),
+        ("Stream Isolation", test_coalesced_stream_isolation),
+        ("Embedding Cache Kinds", test_embedding_cache_task_kinds),
+        ("JSONL Loading", test_jsonl_loader),
+        ("Metrics", test_metrics_endpoint),
         ("System Reset", test_reset_endpoint)
     ]
     